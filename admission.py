@@ -0,0 +1,112 @@
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+from scheduler import PriorityScheduler
+from workers import Overloaded
+
+# ================== НАСТРОЙКИ ==================
+
+# Одновременных запросов к модели на весь бот
+LLM_CONCURRENCY = 8
+
+# Сколько запросов может ждать свободного места, остальным — отказ
+LLM_MAX_QUEUE = 32
+
+# Личный лимит: не больше USER_BURST вопросов подряд,
+# дальше — один вопрос в USER_REFILL_SECONDS
+USER_BURST = 5
+USER_REFILL_SECONDS = 20
+
+# Сколько пользователей держать в памяти лимитов до очистки полных корзин
+MAX_TRACKED_USERS = 10000
+
+LLM_TIME = metrics.histogram("llm_call_seconds", "Время вызова модели")
+RATE_LIMITED = metrics.counter("llm_rejected_total", "Отказы в вызове модели", {"reason": "rate_limit"})
+SHED = metrics.counter("llm_rejected_total", "Отказы в вызове модели", {"reason": "overload"})
+
+
+class RateLimited(Exception):
+
+    def __init__(self, retry_after, user_id=None):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+        self.user_id = user_id
+
+# ================== TOKEN BUCKET ==================
+
+class TokenBucket:
+
+    def __init__(self, capacity, refill_seconds):
+        self.capacity = capacity
+        self.rate = 1 / refill_seconds
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        # 0 — токен выдан, иначе сколько секунд ждать следующего
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+# ================== ДОПУСК К МОДЕЛИ ==================
+
+class Admission:
+
+    def __init__(self, concurrency=LLM_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 burst=USER_BURST, refill_seconds=USER_REFILL_SECONDS):
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        # Места выдаются по ролям взвешенной очередью, см. scheduler.py
+        self.scheduler = PriorityScheduler("llm", concurrency, max_queue)
+        self._buckets = {}
+
+    def _bucket(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._prune()
+            bucket = self._buckets[user_id] = TokenBucket(self.burst, self.refill_seconds)
+        return bucket
+
+    def _prune(self):
+        # Полностью восстановившиеся корзины ничем не отличаются от новых
+        now = time.monotonic()
+        self._buckets = {
+            user_id: bucket
+            for user_id, bucket in self._buckets.items()
+            if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.capacity
+        }
+
+    @asynccontextmanager
+    async def admit(self, user_id, role=None):
+        bucket = self._bucket(user_id)
+        retry_after = bucket.take()
+        if retry_after:
+            RATE_LIMITED.inc()
+            raise RateLimited(retry_after, user_id)
+
+        admitted = False
+        try:
+            async with self.scheduler.slot(role):
+                admitted = True
+                started = time.monotonic()
+                try:
+                    yield
+                finally:
+                    LLM_TIME.observe(time.monotonic() - started)
+        except Overloaded:
+            # Очередь переполнена ещё до вызова модели — токен пользователю возвращается
+            if not admitted:
+                bucket.refund()
+                SHED.inc()
+            raise
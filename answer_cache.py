@@ -0,0 +1,120 @@
+import hashlib
+import re
+import time
+import unicodedata
+
+# ================== НАСТРОЙКИ ==================
+
+CACHE_TTL = 30 * 24 * 3600
+CACHE_MAX_ROWS = 5000
+
+# Увеличивать при изменении normalize_question — ключи кэша пересчитаются
+KEY_VERSION = "2"
+
+# ================== НОРМАЛИЗАЦИЯ ВОПРОСА ==================
+
+# Латинские буквы, которые пишут вместо похожих кириллических
+LOOKALIKES = str.maketrans("aceopxykmthbё", "асеорхукмтнве")
+
+# Знаки и сравнения меняют смысл вопроса («-40 °C» и «+40 °C», «λ ≤ 0,2» и «λ ≥ 0,2»),
+# поэтому становятся словами, а не выбрасываются вместе с пунктуацией
+SIGNS = str.maketrans({
+    "+": " plus ", "-": " minus ", "−": " minus ", "±": " plusminus ",
+    "<": " lt ", ">": " gt ", "≤": " le ", "≥": " ge ", "=": " eq ",
+})
+
+
+def normalize_question(question):
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = text.translate(LOOKALIKES)
+    text = text.translate(SIGNS)
+    text = re.sub(r"[^\w]+", " ", text)
+    return " ".join(text.split())
+
+
+def question_key(question):
+    return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+
+# ================== ТАБЛИЦА КЭША ==================
+
+def init_answer_cache(conn):
+    c = conn.cursor()
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            key TEXT PRIMARY KEY,
+            question TEXT,
+            answer TEXT,
+            created REAL,
+            last_used REAL,
+            hits INTEGER DEFAULT 0
+        )
+    """)
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used ON answer_cache (last_used)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_created ON answer_cache (created)")
+
+    # При первом запуске и при смене KEY_VERSION кэш заполняется заново
+    # из уже накопленных ответов history, с ключами по новым правилам
+    row = c.execute("SELECT value FROM answer_cache_meta WHERE key = 'key_version'").fetchone()
+    if row is None or row[0] != KEY_VERSION:
+        c.execute("DELETE FROM answer_cache")
+        now = time.time()
+        rows = c.execute(
+            "SELECT question, answer FROM history ORDER BY id DESC LIMIT ?",
+            (CACHE_MAX_ROWS,)
+        ).fetchall()
+        c.executemany(
+            "INSERT OR IGNORE INTO answer_cache (key, question, answer, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(question_key(q), q, a, now, now) for q, a in rows if q and a]
+        )
+        c.execute(
+            "INSERT OR REPLACE INTO answer_cache_meta (key, value) VALUES ('key_version', ?)",
+            (KEY_VERSION,)
+        )
+
+    conn.commit()
+
+
+def get_answer(conn, question):
+    row = conn.execute(
+        "SELECT answer FROM answer_cache WHERE key = ? AND created >= ?",
+        (question_key(question), time.time() - CACHE_TTL)
+    ).fetchone()
+
+    return row[0] if row else None
+
+
+def touch_answer(conn, question):
+    conn.execute(
+        "UPDATE answer_cache SET last_used = ?, hits = hits + 1 WHERE key = ?",
+        (time.time(), question_key(question))
+    )
+
+
+def put_answer(conn, question, answer):
+    now = time.time()
+
+    conn.execute(
+        "INSERT OR REPLACE INTO answer_cache (key, question, answer, created, last_used, hits) "
+        "VALUES (?, ?, ?, ?, ?, 0)",
+        (question_key(question), question, answer, now, now)
+    )
+
+    # Устаревшие записи удаляются, а при переполнении — давно не использованные
+    conn.execute("DELETE FROM answer_cache WHERE created < ?", (now - CACHE_TTL,))
+    excess = conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0] - CACHE_MAX_ROWS
+    if excess > 0:
+        conn.execute(
+            "DELETE FROM answer_cache WHERE key IN "
+            "(SELECT key FROM answer_cache ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+# ================== НАСТРОЙКИ ==================
+
+# Нагрузочный прогон всего Application без сети:
+#   python bench_load.py --users 300 --concurrency 60
+# Bot API заменён заглушкой, модель — локальным fake_llm.py, история пишется в копию базы
+
+BENCH_TOKEN = "123456:bench"
+FAKE_LLM_PORT = 8011
+LAG_INTERVAL = 0.01
+
+ROLES = ("user_student", "user_engineer", "user_oldschool")
+
+QUESTIONS = (
+    "Как определить расчётное значение снеговой нагрузки на покрытие?",
+    "Какие коэффициенты надёжности по нагрузке принимаются для постоянных воздействий?",
+    "Как выполняется проверка устойчивости стальной колонны на изгиб с кручением?",
+    "Какой класс последствий отказа принять для жилого здания?",
+    "Как учитывается сейсмическое воздействие при расчёте фундаментов?",
+    "Какая несущая способность деревянной балки при изгибе?",
+    "Что такое сочетание воздействий для аварийной расчётной ситуации?",
+    "Как определить собственный вес конструкций и плотность материалов?",
+    "Как рассчитать несущую способность сваи по результатам испытаний?",
+    "Какой коэффициент поведения q принимать для стальных рам?",
+)
+
+# ================== ЗАГЛУШКА BOT API ==================
+
+class FakeTelegram(BaseRequest):
+
+    # Отвечает на вызовы Bot API как сервер Telegram, с задержкой latency
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self.result(name, params)}).encode()
+
+    def result(self, name, params):
+        if name == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "StructAI", "username": "structai_bench_bot"}
+
+        if name in ("sendMessage", "editMessageText", "sendDocument"):
+            return {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "text": params.get("text", "")
+            }
+
+        return True
+
+# ================== СИНТЕТИЧЕСКИЕ ОБНОВЛЕНИЯ ==================
+
+class Updates:
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, user_id, text, entities=None):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"},
+            "text": text
+        }
+        if entities:
+            message["entities"] = entities
+        return message
+
+    def _update(self, **payload):
+        return Update.de_json({"update_id": next(self._ids), **payload}, self.bot)
+
+    def command(self, user_id, text):
+        length = len(text.split()[0])
+        entities = [{"type": "bot_command", "offset": 0, "length": length}]
+        return self._update(message=self._message(user_id, text, entities))
+
+    def text(self, user_id, text):
+        return self._update(message=self._message(user_id, text))
+
+    def callback(self, user_id, data):
+        return self._update(callback_query={
+            "id": str(next(self._ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": self._message(user_id, "меню")
+        })
+
+# ================== ИЗМЕРЕНИЯ ==================
+
+class Harness:
+
+    # Обработчики в группах -1 и 1 отмечают начало и конец обработки каждого
+    # обновления; send() ждёт конца, поэтому шаги одного пользователя идут по порядку
+
+    def __init__(self, app):
+        self.app = app
+        self.pending = {}
+        self.queue_wait = defaultdict(list)
+        self.handler = defaultdict(list)
+        self.errors = Counter()
+        self.error_types = Counter()
+        self.lag = []
+
+        app.add_handler(TypeHandler(Update, self.on_begin), group=-1)
+        app.add_handler(TypeHandler(Update, self.on_end), group=1)
+        app.add_error_handler(self.on_error)
+
+    async def send(self, kind, update):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update.update_id] = [kind, time.perf_counter(), None, future]
+        await self.app.update_queue.put(update)
+        await future
+
+    async def on_begin(self, update, context):
+        entry = self.pending[update.update_id]
+        entry[2] = time.perf_counter()
+        self.queue_wait[entry[0]].append(entry[2] - entry[1])
+
+    async def on_end(self, update, context):
+        kind, _, began, future = self.pending.pop(update.update_id)
+        self.handler[kind].append(time.perf_counter() - began)
+        future.set_result(None)
+
+    async def on_error(self, update, context):
+        if isinstance(update, Update) and update.update_id in self.pending:
+            kind = self.pending[update.update_id][0]
+            self.errors[kind] += 1
+            self.error_types[kind, type(context.error).__name__] += 1
+
+    async def watch_loop_lag(self):
+        # Насколько позже заказанного просыпается sleep — задержка цикла событий
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lag.append(time.perf_counter() - started - LAG_INTERVAL)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+# ================== СЦЕНАРИЙ ==================
+
+async def virtual_user(harness, updates, user_id, args, rnd):
+    await harness.send("start", updates.command(user_id, "/start"))
+    await harness.send("callback", updates.callback(user_id, rnd.choice(ROLES)))
+
+    if rnd.random() < args.suggest_share:
+        await harness.send("callback", updates.callback(user_id, "suggestions"))
+        await harness.send("suggestion", updates.text(user_id, f"Предложение от пользователя {user_id}"))
+        return
+
+    await harness.send("callback", updates.callback(user_id, "mode_study"))
+    await harness.send("callback", updates.callback(user_id, "back_role"))
+    await harness.send("callback", updates.callback(user_id, "mode_question"))
+
+    for i in range(args.questions):
+        question = rnd.choice(QUESTIONS)
+        if args.unique:
+            # Без повторов вопросы не попадают в кэш ответов и не объединяются single-flight
+            question += f" (вариант {user_id}-{i})"
+        await harness.send("ai_message", updates.text(user_id, question))
+
+    await harness.send("callback", updates.callback(user_id, "back_start"))
+
+
+async def run(args, workdir):
+    # bot импортируется только здесь: DB_FILE и LLM_BASE_URL уже указывают на стенд
+    import bot
+
+    bot.EXCEL_FILE = os.path.join(workdir, "suggestions.xlsx")
+    bot.init_ai_db()
+
+    # Индексы готовы до замеров, как в bot.main(); FAISS в копии БД пересобирается здесь
+    bot.pdf_index.get_index(bot.PDF_FOLDER)
+    bot.vector_index.load()
+
+    if args.traces:
+        bot.tracing.start(args.traces)
+
+    transport = FakeTelegram(args.api_latency)
+    app = bot.build_application(BENCH_TOKEN, request=transport)
+    harness = Harness(app)
+    updates = Updates(app.bot)
+
+    await app.initialize()
+    await app.start()
+    lag_task = asyncio.create_task(harness.watch_loop_lag())
+
+    rnd = random.Random(args.seed)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(user_id):
+        async with slots:
+            await virtual_user(harness, updates, user_id, args, random.Random(rnd.random()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(100000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    await app.stop()
+    await app.shutdown()
+    await bot.on_shutdown(app)
+
+    report(harness, transport, elapsed)
+
+
+def report(harness, transport, elapsed):
+    total = sum(len(values) for values in harness.handler.values())
+    print(f"\nОбновлений: {total} за {elapsed:.1f} с — {total / elapsed:.1f} updates/s\n")
+
+    print(f"{'тип':<12}{'кол-во':>8}{'ошибки':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'очередь p99':>13}")
+    for kind, values in sorted(harness.handler.items()):
+        print(
+            f"{kind:<12}{len(values):>8}{harness.errors[kind]:>8}"
+            f"{percentile(values, 50):>9.3f}{percentile(values, 95):>9.3f}"
+            f"{percentile(values, 99):>9.3f}{max(values):>9.3f}"
+            f"{percentile(harness.queue_wait[kind], 99):>13.3f}"
+        )
+
+    lag = harness.lag
+    print(
+        f"\nЗадержка цикла событий, с: p50={percentile(lag, 50):.4f} "
+        f"p99={percentile(lag, 99):.4f} max={max(lag, default=0):.4f}"
+    )
+    print("Вызовы Bot API:", dict(transport.calls.most_common()))
+
+    for (kind, error), count in harness.error_types.most_common():
+        print(f"Ошибки {kind}: {error} × {count}")
+
+# ================== СТЕНД ==================
+
+def copy_database(source, target):
+    # Копия через backup API — целостная даже при открытом WAL
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"fake_llm не запустился на порту {port}")
+
+
+def start_fake_llm(args):
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_llm.py"),
+        "--port", str(FAKE_LLM_PORT),
+        "--latency", str(args.llm_latency),
+        "--tps", str(args.llm_tps),
+        "--tokens", str(args.llm_tokens),
+        "--error-rate", str(args.llm_error_rate),
+        "--seed", str(args.seed)
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    wait_for_port(FAKE_LLM_PORT)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на синтетических обновлениях")
+    parser.add_argument("--users", type=int, default=200, help="сколько виртуальных пользователей пройдут сценарий")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько из них активны одновременно")
+    parser.add_argument("--questions", type=int, default=3, help="вопросов к ИИ на пользователя")
+    parser.add_argument("--suggest-share", type=float, default=0.1, help="доля пользователей, оставляющих предложение")
+    parser.add_argument("--unique", action="store_true", help="все вопросы разные (без кэша и single-flight)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--llm-url", default=None, help="готовый OpenAI-совместимый сервер вместо fake_llm.py")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-tps", type=float, default=100)
+    parser.add_argument("--llm-tokens", type=int, default=60)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--db", default="structai_ai.db", help="база, копия которой используется в прогоне")
+    parser.add_argument("--traces", help="писать трассы в этот файл (разбор: python tracing.py --file ...)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="structai-bench-")
+    fake_llm = None
+
+    try:
+        database = os.path.join(workdir, "structai_ai.db")
+        if os.path.exists(args.db):
+            copy_database(args.db, database)
+        os.environ["DB_FILE"] = database
+
+        if args.llm_url:
+            os.environ["LLM_BASE_URL"] = args.llm_url
+        else:
+            fake_llm = start_fake_llm(args)
+            os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{FAKE_LLM_PORT}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+        asyncio.run(run(args, workdir))
+    finally:
+        if fake_llm is not None:
+            fake_llm.terminate()
+            fake_llm.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import json
+import time
+
+import context_pack
+import pdf_index
+import pdf_store
+import vector_index
+
+# ================== НАСТРОЙКИ ==================
+
+# Качество и скорость поиска по pdf_db на размеченных вопросах:
+#   python bench_retrieval.py --k 5
+# В bench_qrels.json для каждого вопроса — файл и номера страниц (с 1, как в просмотрщике PDF),
+# где находится ответ
+
+QRELS_FILE = "bench_qrels.json"
+K = 5
+REPEAT = 3
+
+# ================== ПОИСКОВИКИ ==================
+
+# Каждый возвращает ранжированный список (файл, номер страницы с 0)
+
+def substring_search(question, k, pages):
+    # Исходный search_in_pdfs: первая страница, содержащая первые 30 символов вопроса.
+    # Текст страниц берётся из кэша, без повторного разбора PDF
+    needle = question.lower()[:30]
+    for file, page_no, text in pages:
+        if text and needle in text.lower():
+            return [(file, page_no)]
+    return []
+
+
+def bm25_search(question, k, pages):
+    return [(hit.file, hit.page_no) for hit in pdf_index.search(question, k, folder=pdf_store.PDF_FOLDER)]
+
+
+def faiss_search(question, k, pages):
+    return [(passage.document, passage.page_no) for passage in vector_index.search(question, k)]
+
+
+def hybrid_search(question, k, pages):
+    # Кандидаты BM25 и FAISS в том порядке, в каком их видит упаковка контекста
+    sources = context_pack.dedupe(context_pack.candidates(question, k))
+    return [(source.document, source.page_no) for source in sources[:k]]
+
+
+ENGINES = {
+    "substring": substring_search,
+    "bm25": bm25_search,
+    "faiss": faiss_search,
+    "hybrid": hybrid_search,
+}
+
+# ================== ОЦЕНКА ==================
+
+def load_qrels(path):
+    with open(path, encoding="utf-8") as f:
+        qrels = json.load(f)
+    for item in qrels:
+        item["relevant"] = {(item["document"], page - 1) for page in item["pages"]}
+    return qrels
+
+
+def check_corpus(qrels, pages):
+    known = {(file, page_no) for file, page_no, _ in pages}
+    for item in qrels:
+        missing = item["relevant"] - known
+        if missing:
+            print(f"⚠ Нет в корпусе: {item['document']} стр. {sorted(p + 1 for _, p in missing)}")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def evaluate(engine, qrels, k, pages, repeat):
+    recall = 0.0
+    hits_at_1 = 0
+    reciprocal = 0.0
+    latencies = []
+    misses = []
+
+    for item in qrels:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ranked = engine(item["question"], k, pages)[:k]
+            latencies.append(time.perf_counter() - started)
+
+        relevant = item["relevant"]
+        found = [i for i, result in enumerate(ranked) if result in relevant]
+
+        recall += len(relevant & set(ranked)) / len(relevant)
+        if found:
+            reciprocal += 1 / (found[0] + 1)
+            hits_at_1 += found[0] == 0
+        else:
+            misses.append((item, ranked))
+
+    n = len(qrels)
+    return {
+        "recall@1": hits_at_1 / n,
+        f"recall@{k}": recall / n,
+        "mrr": reciprocal / n,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }, misses
+
+
+def describe(ranked):
+    return ", ".join(f"{file} стр. {page_no + 1}" for file, page_no in ranked[:3]) or "ничего"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение поиска по pdf_db: recall@k, MRR и время ответа")
+    parser.add_argument("--qrels", default=QRELS_FILE)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="повторов каждого запроса для замера времени")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="через запятую: " + ", ".join(ENGINES))
+    parser.add_argument("--misses", action="store_true", help="показать вопросы, для которых ответ не найден")
+    parser.add_argument("--json", help="сохранить результаты в файл для сравнения прогонов")
+    args = parser.parse_args()
+
+    qrels = load_qrels(args.qrels)
+
+    # Кэш страниц и индексы строятся до замеров
+    started = time.perf_counter()
+    pages = pdf_store.get_pages(pdf_store.PDF_FOLDER)
+    pdf_index.get_index(pdf_store.PDF_FOLDER)
+    vector_index.search("прогрев", 1)
+    print(f"Страниц: {len(pages)}, индексы готовы за {time.perf_counter() - started:.1f} с, вопросов: {len(qrels)}\n")
+    check_corpus(qrels, pages)
+
+    results = {}
+    print(f"{'поиск':<11}{'recall@1':>10}{f'recall@{args.k}':>10}{'MRR':>8}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}")
+
+    for name in args.engines.split(","):
+        summary, misses = evaluate(ENGINES[name], qrels, args.k, pages, args.repeat)
+        results[name] = summary
+        print(
+            f"{name:<11}{summary['recall@1']:>10.2f}{summary[f'recall@{args.k}']:>10.2f}{summary['mrr']:>8.2f}"
+            f"{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}{summary['max_ms']:>10.2f}"
+        )
+
+        if args.misses:
+            for item, ranked in misses:
+                print(f"   ✗ {item['question']}\n     ожидалось {item['document']} стр. {item['pages']}, найдено: {describe(ranked)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "questions": len(qrels), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,114 @@
+import asyncio
+import io
+import math
 import os
-import sqlite3
+import tempfile
+import threading
+import time
 from datetime import datetime
-from openpyxl import Workbook, load_workbook
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
-from openai import OpenAI
-
-try:
-    import PyPDF2
-except ImportError:
-    PyPDF2 = None
-
+from telegram.request import BaseRequest, HTTPXRequest
+import httpx
+from openai import APIError
+
+from admission import Admission, RateLimited
+from answer_cache import get_answer, init_answer_cache, put_answer, question_key, touch_answer
+from circuit import CircuitBreaker
+from context_pack import estimate_tokens, format_sources, pack_context
+from db import DB_FILE, connect, database
+import excel_export
+from history_search import find_similar_answer, init_history_fts, search_history
+import llm
+import load_docs
+import metrics
+import pdf_index
+import profiler
+import tracing
+import vector_index
+from scheduler import PriorityScheduler
+from suggestions import (
+    EXPORT_INTERVAL, add_suggestion, export_suggestions, init_suggestions, last_suggestion_id
+)
+from singleflight import SingleFlight
+from workers import Overloaded, io_pool, retrieval_pool
 from structure import MENU_STRUCTURE
 from content import CONTENT
 
 # ================== НАСТРОЙКИ ==================
 
 TOKEN = os.getenv("BOT_TOKEN")
-OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+
+# Telegram ID администраторов через запятую
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}
 
 EXCEL_FILE = "suggestions.xlsx"
-DB_FILE = "structai_ai.db"
 PDF_FOLDER = "pdf_db"
-
-# ================== AI CLIENT ==================
-
-ai_client = OpenAI(
-    api_key=OPENAI_KEY,
-    base_url="https://openrouter.ai/api/v1"
-)
+# Страница отдаётся без модели только при сильном совпадении: BM25 не ниже
+# PDF_MIN_SCORE, найдено не меньше PDF_MIN_TERMS слов вопроса и почти все слова
+PDF_MIN_SCORE = 25
+PDF_MIN_TERMS = 5
+PDF_MIN_COVERAGE = 0.8
+CONCURRENT_UPDATES = 64
+TELEGRAM_POOL_SIZE = 256
+RETRIEVAL_MAX_QUEUE = 64
+
+# Таймауты ответа модели: до первого токена и между токенами
+LLM_FIRST_TOKEN_TIMEOUT = 20
+LLM_STALL_TIMEOUT = 15
+
+# Telegram ограничивает частоту правок сообщения и его длину
+EDIT_INTERVAL = 1.5
+MESSAGE_LIMIT = 4096
+
+# Наибольшая пауза между повторами итоговой правки при сетевых сбоях, секунды
+FINISH_MAX_DELAY = 30
+
+# /profile без аргумента снимает профиль за столько секунд
+PROFILE_SECONDS = 30
+
+# Бот может отправить документ не больше 50 МБ
+DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+# Локальный /metrics в формате Prometheus; METRICS_PORT=0 — не запускать
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# ================== МЕТРИКИ ==================
+
+def stage(name):
+    return metrics.histogram("stage_seconds", "Время этапов обработки запроса", {"stage": name})
+
+HANDLE_MESSAGE_TIME = stage("handle_message")
+ASK_AI_TIME = stage("ask_ai")
+PDF_SEARCH_TIME = stage("pdf_search")
+CACHE_LOOKUP_TIME = stage("cache_lookup")
+CONTEXT_PACK_TIME = stage("context_pack")
+HISTORY_WRITE_TIME = stage("history_write")
+SUGGESTION_TIME = stage("save_suggestion")
+EXPORT_TIME = stage("suggestions_export")
+ADMIN_EXPORT_TIME = stage("admin_export")
+EDIT_TEXT_TIME = stage("edit_text")
+
+def answer_source(source):
+    return metrics.counter("ai_answers_total", "Ответы по источнику", {"source": source})
+
+def cache_lookup(result):
+    return metrics.counter("answer_cache_lookups_total", "Поиск в кэше ответов: hit, similar, miss", {"result": result})
 
 # ================== ИНИЦИАЛИИЗАЦИЯ БД ==================
 
 def init_ai_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect(DB_FILE)
     c = conn.cursor()
 
     c.execute("""
@@ -54,278 +122,750 @@ def init_ai_db():
     """)
 
     conn.commit()
+
+    init_answer_cache(conn)
+    init_history_fts(conn)
+    init_suggestions(conn, EXCEL_FILE)
     conn.close()
 
 # ================== PDF БАЗА ==================
 
 def search_in_pdfs(question):
 
-    if PyPDF2 is None:
-        return None
+    # Ранжирование BM25 по инвертированному индексу страниц; короткие и общие
+    # вопросы («что такое нагрузка?») совпадают со случайными страницами,
+    # поэтому без модели отвечаем только на длинное и точное совпадение
+    with tracing.span("pdf_search", PDF_SEARCH_TIME):
+        hits = pdf_index.search(question, k=1, folder=PDF_FOLDER)
 
-    if not os.path.exists(PDF_FOLDER):
+    if not hits:
         return None
 
-    question = question.lower()
-
-    for file in os.listdir(PDF_FOLDER):
-        if file.endswith(".pdf"):
-            path = os.path.join(PDF_FOLDER, file)
-
-            with open(path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-
-                for page in reader.pages:
-                    text = page.extract_text()
-                    if text and question[:30] in text.lower():
-                        return f"📚 Найдено в {file}:\n\n" + text[:1500]
+    hit = hits[0]
+    if hit.score >= PDF_MIN_SCORE and hit.matched >= PDF_MIN_TERMS and hit.coverage >= PDF_MIN_COVERAGE:
+        return f"📚 Найдено в {hit.file} (стр. {hit.page_no + 1}):\n\n" + hit.text[:1500]
 
     return None
 
 # ================== AI ==================
 
-async def ask_ai(user_id, question):
-
-    pdf_answer = search_in_pdfs(question)
-    if pdf_answer:
-        return pdf_answer
-
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute(
-        "SELECT answer FROM history WHERE question LIKE ? LIMIT 1",
-        (f"%{question[:20]}%",)
-    )
-    row = c.fetchone()
-    conn.close()
-
-    if row:
-        return "📚 Найдено в базе:\n\n" + row[0]
-
-    response = ai_client.chat.completions.create(
-        model="mistralai/mistral-7b-instruct",
-        messages=[
-            {
-                "role": "system",
-                "content": """Ты инженерный ассистент по Еврокодам EN 1990–1999.
-Используй нормативную базу.
-Не выдумывай пункты норм.
-Если вопрос вне проектирования — сообщи об этом."""
-            },
-            {"role": "user", "content": question}
-        ],
-        temperature=0.2,
-        max_tokens=900
-    )
-
-    answer = response.choices[0].message.content
-
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute(
+inflight = SingleFlight()
+admission = Admission()
+retrieval_scheduler = PriorityScheduler("retrieval", retrieval_pool.workers, RETRIEVAL_MAX_QUEUE)
+breaker = CircuitBreaker()
+
+DEGRADED = metrics.counter("ai_degraded_total", "Ответы только по базе без модели")
+DEGRADED_NOTE = "⚠ Модель сейчас недоступна — ответ подобран только по нормативной базе, без ИИ.\n\n"
+
+def find_cached_answer(question):
+    # Кэш ответов по хешу нормализованного вопроса — поиск по первичному ключу,
+    # при промахе — почти такой же вопрос из истории через FTS5
+    with tracing.span("cache_lookup", CACHE_LOOKUP_TIME), database.reader() as conn:
+        answer = get_answer(conn, question)
+        if answer is not None:
+            cache_lookup("hit").inc()
+            database.write(touch_answer, question)
+            return "📚 Найдено в базе:\n\n" + answer
+
+        similar = find_similar_answer(conn, question)
+        cache_lookup("similar" if similar else "miss").inc()
+        if similar is None:
+            return None
+        # Пользователь видит, на какой именно вопрос был дан этот ответ
+        return f"📚 Ответ на похожий вопрос из базы: «{similar.question}»\n\n" + similar.answer
+
+def save_history(conn, user_id, question, answer):
+    # Выполняется потоком-писателем database в общей групповой транзакции
+    conn.execute(
         "INSERT INTO history (user_id, question, answer, date) VALUES (?, ?, ?, ?)",
         (user_id, question, answer, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     )
-    conn.commit()
-    conn.close()
+    put_answer(conn, question, answer)
+
+async def ask_ai(user_id, question, on_progress=None, role=None):
+
+    # Одинаковые вопросы, заданные одновременно, разделяют один поиск и один вызов модели
+    # (приоритет общего выполнения — по роли того, кто спросил первым)
+    with tracing.span("ask_ai", ASK_AI_TIME):
+        while True:
+            try:
+                return await inflight.do(
+                    question_key(question),
+                    lambda progress: answer_question(user_id, question, progress, role),
+                    on_progress
+                )
+            except RateLimited as e:
+                # Личный лимит исчерпал тот, кто запустил общее выполнение, а не этот
+                # пользователь, — повторяем, теперь уже со своим лимитом
+                if e.user_id == user_id:
+                    raise
+
+async def answer_question(user_id, question, on_progress, role):
+
+    # Поиск и SQLite — в пулах потоков, цикл событий не блокируется;
+    # очередь к ним при нагрузке упорядочена по ролям. Страница без модели —
+    # только при точном совпадении, остальное модель получает как контекст
+    # из лучших фрагментов BM25 и FAISS и отвечает со ссылками на источники
+    async with retrieval_scheduler.slot(role):
+        cached = await io_pool.run(find_cached_answer, question)
+        if cached:
+            answer_source("cache").inc()
+            return cached
+
+        pdf_answer = await retrieval_pool.run(search_in_pdfs, question)
+        if pdf_answer:
+            answer_source("pdf").inc()
+            return pdf_answer
+
+        context, sources = await retrieval_pool.run(build_context, question)
+
+    # Модель недоступна — сразу отвечаем по локальным индексам
+    if not breaker.allow():
+        return await degraded_answer(question)
+
+    # Лимиты вызовов модели: общий по числу мест, личный по частоте вопросов.
+    # on_progress получает накопленный текст по мере генерации
+    answer = ""
+    queued = tracing.start_span("llm.queue")
+    try:
+        async with admission.admit(user_id, role):
+            queued.end()
+            first_token = tracing.start_span("llm.first_token")
+            last_token = tracing.start_span("llm.last_token")
+            try:
+                # Первый токен — не позже LLM_FIRST_TOKEN_TIMEOUT, дальше паузы не длиннее LLM_STALL_TIMEOUT
+                async with asyncio.timeout(LLM_FIRST_TOKEN_TIMEOUT) as deadline:
+                    async for delta in llm.stream(question, context):
+                        first_token.end()
+                        deadline.reschedule(asyncio.get_running_loop().time() + LLM_STALL_TIMEOUT)
+                        answer += delta
+                        await on_progress(answer)
+            finally:
+                last_token.end()
+    except (APIError, httpx.HTTPError, TimeoutError):
+        breaker.failure()
+        if answer:
+            return answer + "\n\n⚠ Ответ прерван: модель перестала отвечать."
+        return await degraded_answer(question)
+    except BaseException:
+        breaker.release()
+        raise
+
+    breaker.success()
+    answer_source("llm").inc()
+
+    if sources:
+        answer += "\n\n📚 Источники:\n" + format_sources(sources)
+
+    with tracing.span("sqlite.history_insert", HISTORY_WRITE_TIME):
+        await database.write_async(save_history, user_id, question, answer)
 
     return answer
 
-# ================== EXCEL ==================
+def build_context(question):
+    # Лучшие фрагменты pdf_db в пределах бюджета токенов запроса
+    with tracing.span("context_pack", CONTEXT_PACK_TIME):
+        return pack_context(question, estimate_tokens(llm.prompt_overhead(question)))
 
-def save_to_excel(user, text):
+def retrieval_only_answer(question):
 
-    if not os.path.exists(EXCEL_FILE):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Предложения"
-        ws.append(["Дата", "Username", "User ID", "Текст"])
-        wb.save(EXCEL_FILE)
+    # Лучшее, что есть локально, без порогов уверенности: страница норм
+    # или ответ на похожий вопрос из истории
+    hits = pdf_index.search(question, k=1, folder=PDF_FOLDER)
+    if hits:
+        hit = hits[0]
+        return f"📚 {hit.file} (стр. {hit.page_no + 1}):\n\n" + hit.text[:1500]
 
-    wb = load_workbook(EXCEL_FILE)
-    ws = wb.active
+    with database.reader() as conn:
+        past = search_history(conn, question, 1)
+    if past:
+        return f"📚 Похожий вопрос из базы: «{past[0].question}»\n\n" + past[0].answer
 
-    ws.append([
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        user.username,
-        user.id,
-        text
-    ])
+    return None
 
-    wb.save(EXCEL_FILE)
+async def degraded_answer(question):
+    DEGRADED.inc()
+    answer_source("degraded").inc()
+    answer = await retrieval_pool.run(retrieval_only_answer, question)
+    if answer is None:
+        return DEGRADED_NOTE + "По базе ничего не найдено. Попробуйте, пожалуйста, позже."
+    return DEGRADED_NOTE + answer
+
+# ================== ПРЕДЛОЖЕНИЯ ==================
+
+# Предложения хранятся в SQLite; EXCEL_FILE — выгрузка, которая обновляется
+# раз в EXPORT_INTERVAL, если появились новые строки, и при остановке бота
+_exported_suggestion = None
+
+# Отмена export_loop не останавливает выгрузку, уже идущую в потоке io_pool, —
+# выгрузка при остановке ждёт её, а не пишет тот же EXCEL_FILE + ".tmp" параллельно
+_export_lock = threading.Lock()
+
+async def save_suggestion(user, text):
+    with tracing.span("sqlite.suggestion_insert", SUGGESTION_TIME):
+        await database.write_async(add_suggestion, user.id, user.username, text)
+
+def export_suggestions_file():
+    global _exported_suggestion
+
+    with _export_lock, tracing.span("suggestions_export", EXPORT_TIME), database.reader() as conn:
+        last = last_suggestion_id(conn)
+        if last == _exported_suggestion:
+            return
+        export_suggestions(conn, EXCEL_FILE)
+        _exported_suggestion = last
+
+async def export_loop():
+    while True:
+        await asyncio.sleep(EXPORT_INTERVAL)
+        try:
+            await io_pool.run(export_suggestions_file)
+        except Exception as e:
+            print("Не удалось выгрузить предложения:", e)
+
+# ================== КЛАВИАТУРЫ ==================
+
+# Разметка неизменяемая (кортежи кнопок), поэтому строится один раз при импорте
+# и переиспользуется при каждом нажатии
+
+BACK_TO_ROLE = InlineKeyboardButton("⬅ Назад", callback_data="back_role")
+BACK_TO_STUDY = InlineKeyboardButton("⬅ Назад", callback_data="mode_study")
+HOME = InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")
+
+START_TEXT = (
+    "Добро пожаловать в StructAI.\n"
+    "Это учебный и справочный бот по Еврокодам (СП РК EN).\n\n"
+    "Пожалуйста, ответьте, кто Вы?"
+)
+
+START_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎓 Студент", callback_data="user_student")],
+    [InlineKeyboardButton("🏗 Практикующий инженер", callback_data="user_engineer")],
+    [InlineKeyboardButton("📐 Инженер старой школы", callback_data="user_oldschool")],
+    [InlineKeyboardButton("💬 Предложения", callback_data="suggestions")]
+])
+
+ROLE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📘 Изучать нормы поэтапно", callback_data="mode_study")],
+    [InlineKeyboardButton("🤖 Задать вопрос по Еврокодам", callback_data="mode_question")],
+    [InlineKeyboardButton("⬅ Назад", callback_data="back_start")],
+    [HOME]
+])
+
+STUDY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("EN 1990 – Основы", callback_data="study_1990")],
+    [InlineKeyboardButton("EN 1991 – Нагрузки", callback_data="study_1991")],
+    [BACK_TO_ROLE],
+    [HOME]
+])
+
+QUESTION_KEYBOARD = InlineKeyboardMarkup([[BACK_TO_ROLE], [HOME]])
+STUDY_PAGE_KEYBOARD = InlineKeyboardMarkup([[BACK_TO_STUDY], [HOME]])
+
+# study_<номер> → ключ материала в CONTENT
+STUDY_PAGES = {
+    "1990": "EN1990",
+    "1991": "EN1991",
+}
 
 # ================== ГЛАВНОЕ МЕНЮ ==================
 
 async def show_start(update: Update, context: ContextTypes.DEFAULT_TYPE, edit=False):
-
-    keyboard = [
-        [InlineKeyboardButton("🎓 Студент", callback_data="user_student")],
-        [InlineKeyboardButton("🏗 Практикующий инженер", callback_data="user_engineer")],
-        [InlineKeyboardButton("📐 Инженер старой школы", callback_data="user_oldschool")],
-        [InlineKeyboardButton("💬 Предложения", callback_data="suggestions")]
-    ]
-
-    text = (
-        "Добро пожаловать в StructAI.\n"
-        "Это учебный и справочный бот по Еврокодам (СП РК EN).\n\n"
-        "Пожалуйста, ответьте, кто Вы?"
-    )
-
     if edit:
-        await update.callback_query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await update.callback_query.edit_message_text(START_TEXT, reply_markup=START_KEYBOARD)
     else:
-        await update.message.reply_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await update.message.reply_text(START_TEXT, reply_markup=START_KEYBOARD)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_start(update, context)
 
-    # ======== УЧЕБНЫЙ МОДУЛЬ ========
+# ================== CALLBACK ==================
 
-    if data == "study_1990":
+def cancel_ai_task(context):
+    task = context.user_data.pop("ai_task", None)
+    if task and not task.done():
+        task.cancel()
 
-        text = CONTENT.get("EN1990", "Материал EN 1990 пока не добавлен.")
+async def on_suggestions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["suggest_mode"] = True
+    await update.callback_query.edit_message_text("Напишите ваше предложение:")
 
-        keyboard = [
-            [InlineKeyboardButton("⬅ Назад", callback_data="mode_study")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")]
-        ]
+async def on_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["role"] = update.callback_query.data
+    await show_role_menu(update, context)
 
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+async def show_role_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text("Что Вы хотите?", reply_markup=ROLE_KEYBOARD)
+
+async def on_study(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text("Выберите норматив для изучения:", reply_markup=STUDY_KEYBOARD)
+
+async def on_study_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    number = update.callback_query.data.partition("_")[2]
+    key = STUDY_PAGES.get(number)
+    if key is None:
         return
+    text = CONTENT.get(key, f"Материал EN {number} пока не добавлен.")
+    await update.callback_query.edit_message_text(text, reply_markup=STUDY_PAGE_KEYBOARD)
+
+async def on_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["ai_mode"] = True
+    await update.callback_query.edit_message_text("Напишите ваш вопрос по Еврокодам:", reply_markup=QUESTION_KEYBOARD)
+
+async def on_back_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.clear()
+    await show_start(update, context, edit=True)
+
+# callback_data → обработчик. Сначала точное совпадение, затем префикс до первого «_»
+# включительно (user_student → user_): один поиск в словаре вместо цепочки if
+CALLBACK_ROUTES = {
+    "suggestions": on_suggestions,
+    "user_": on_role,
+    "mode_study": on_study,
+    "study_": on_study_page,
+    "mode_question": on_question,
+    "back_role": show_role_menu,
+    "back_start": on_back_start,
+}
+
+def route_callback(data):
+    route = CALLBACK_ROUTES.get(data)
+    if route is None:
+        prefix, sep, _ = data.partition("_")
+        route = CALLBACK_ROUTES.get(prefix + sep)
+    return route
 
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with tracing.span("handle_callback", data=update.callback_query.data):
+        await dispatch_callback(update, context)
 
-    if data == "study_1991":
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
-        text = CONTENT.get("EN1991", "Материал EN 1991 пока не добавлен.")
+    query = update.callback_query
+    await query.answer()
+    data = query.data or ""
+
+    # Любая другая кнопка — выход из режима вопросов, незавершённый запрос к ИИ отменяется
+    if data != "mode_question":
+        context.user_data.pop("ai_mode", None)
+        cancel_ai_task(context)
+
+    route = route_callback(data)
+    if route is not None:
+        await route(update, context)
+
+# ================== ПОТОКОВЫЙ ОТВЕТ ==================
+
+class MessageStreamer:
+
+    # Показывает ответ по мере генерации, редактируя сообщение-заглушку
+    # не чаще EDIT_INTERVAL и с учётом RetryAfter от Telegram
+
+    def __init__(self, message, interval=EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.text = ""
+        self.sent = None
+        self.next_edit = 0.0
+        self._task = None
+        self._editing = False
+
+    async def update(self, text):
+        self.text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        delay = self.next_edit - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._editing = True
+        try:
+            await self._edit(self.text + " ▌")
+        except TelegramError:
+            # Промежуточные правки не критичны — итоговый текст отправит finish
+            pass
+        finally:
+            self._editing = False
+
+    async def _edit(self, text):
+        text = text[:MESSAGE_LIMIT]
+        if text == self.sent:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            with EDIT_TEXT_TIME.time():
+                await self.message.edit_text(text)
+            self.sent = text
+        except RetryAfter as e:
+            self.next_edit = loop.time() + e.retry_after
+            raise
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.next_edit = loop.time() + self.interval
+
+    async def finish(self, text):
+        # Промежуточную правку отменяем, только пока она ждёт своей очереди: уже
+        # отправленный запрос отмена не остановит, и он может дойти до Telegram
+        # позже итогового, оставив обрезанный текст с « ▌»
+        task = self._task
+        if task is not None and not task.done():
+            if not self._editing:
+                task.cancel()
+            await asyncio.wait([task])
+            if not task.cancelled():
+                task.exception()
+
+        # Что не помещается в одно сообщение (например, список источников
+        # после длинного ответа), уходит следующими сообщениями
+        first, *rest = split_message(text)
+        if not await self._edit_final(first):
+            rest.insert(0, first)
+
+        for part in rest:
+            await self.message.reply_text(part)
+
+    async def _edit_final(self, text):
+        # Итоговый ответ не должен потеряться: RetryAfter и сетевые сбои повторяем,
+        # пока правка не пройдёт или обработчик не отменят; False — Telegram правку
+        # отклонил (сообщение удалено и т. п.), ответ уйдёт новым сообщением
+        delay = 1
+        while True:
+            try:
+                await self._edit(text)
+                return True
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except BadRequest:
+                return False
+            except NetworkError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FINISH_MAX_DELAY)
+            except TelegramError:
+                return False
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    # Режем по переводу строки, если он не слишком далеко от предела
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
 
-        keyboard = [
-            [InlineKeyboardButton("⬅ Назад", callback_data="mode_study")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")]
-        ]
+# ================== ОБРАБОТКА ТЕКСТА ==================
 
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with tracing.span("handle_message", HANDLE_MESSAGE_TIME):
+        await process_message(update, context)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if context.user_data.get("suggest_mode"):
+        await save_suggestion(update.message.from_user, update.message.text)
+        context.user_data["suggest_mode"] = False
+        await update.message.reply_text("Спасибо! Предложение сохранено ✅")
         return
 
-# ================== CALLBACK ==================
+    if context.user_data.get("ai_mode"):
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        msg = await update.message.reply_text("Анализ нормативной базы...")
+        streamer = MessageStreamer(msg)
 
-    query = update.callback_query
-    await query.answer()
-    data = query.data
+        role = context.user_data.get("role")
+        started = time.monotonic()
 
-    if data == "suggestions":
-        context.user_data["suggest_mode"] = True
-        await query.edit_message_text("Напишите ваше предложение:")
+        task = asyncio.create_task(ask_ai(
+            update.message.from_user.id,
+            update.message.text,
+            on_progress=streamer.update,
+            role=role
+        ))
+        context.user_data["ai_task"] = task
+
+        try:
+            answer = await task
+        except asyncio.CancelledError:
+            # Отменён сам обработчик (остановка бота) — пробрасываем дальше
+            if asyncio.current_task().cancelling():
+                raise
+            answer = "Запрос отменён."
+        except RateLimited as e:
+            answer = f"Слишком много вопросов подряд. Следующий можно задать через {math.ceil(e.retry_after)} с."
+        except Overloaded:
+            answer = "Сейчас слишком много запросов. Попробуйте, пожалуйста, через минуту."
+        except APIError:
+            answer = "Не удалось получить ответ от модели. Попробуйте, пожалуйста, позже."
+        finally:
+            if context.user_data.get("ai_task") is task:
+                context.user_data.pop("ai_task")
+            metrics.histogram(
+                "ai_request_seconds", "Время ответа на вопрос", {"role": retrieval_scheduler.role_of(role)}
+            ).observe(time.monotonic() - started)
+
+        await streamer.finish(answer)
         return
 
-    if data.startswith("user_"):
+# ================== АДМИНИСТРИРОВАНИЕ ==================
 
-        context.user_data["role"] = data
+def is_admin(update: Update):
+    return update.effective_user is not None and update.effective_user.id in ADMIN_IDS
 
-        keyboard = [
-            [InlineKeyboardButton("📘 Изучать нормы поэтапно", callback_data="mode_study")],
-            [InlineKeyboardButton("🤖 Задать вопрос по Еврокодам", callback_data="mode_question")],
-            [InlineKeyboardButton("⬅ Назад", callback_data="back_start")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")]
-        ]
-
-        await query.edit_message_text(
-            "Что Вы хотите?",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+def format_history(hits):
+    lines = []
+    for hit in hits:
+        lines.append(
+            f"#{hit.id} · {hit.date} · user {hit.user_id}\n"
+            f"❓ {hit.question[:200]}\n"
+            f"💬 {(hit.answer or '')[:400]}"
         )
+    return "\n\n".join(lines)[:MESSAGE_LIMIT]
+
+def run_history_search(text, limit):
+    with database.reader() as conn:
+        return search_history(conn, text, limit)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if not is_admin(update):
         return
 
-    if data == "mode_study":
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text("Использование: /search <текст>")
+        return
 
-        keyboard = [
-            [InlineKeyboardButton("EN 1990 – Основы", callback_data="study_1990")],
-            [InlineKeyboardButton("EN 1991 – Нагрузки", callback_data="study_1991")],
-            [InlineKeyboardButton("⬅ Назад", callback_data="back_role")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")]
-        ]
+    hits = await io_pool.run(run_history_search, text, 5)
 
-        await query.edit_message_text(
-            "Выберите норматив для изучения:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    if not hits:
+        await update.message.reply_text("Ничего не найдено.")
         return
 
-    if data == "mode_question":
-        context.user_data["ai_mode"] = True
-        await query.edit_message_text(
-            "Напишите ваш вопрос по Еврокодам:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅ Назад", callback_data="back_role")],
-                [InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")]
-            ])
-        )
+    await update.message.reply_text(format_history(hits))
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if not is_admin(update):
         return
 
-    if data == "back_role":
+    lines = [f"{name} {value}" for name, value in metrics.snapshot()]
 
-        keyboard = [
-            [InlineKeyboardButton("📘 Изучать нормы поэтапно", callback_data="mode_study")],
-            [InlineKeyboardButton("🤖 Задать вопрос по Еврокодам", callback_data="mode_question")],
-            [InlineKeyboardButton("⬅ Назад", callback_data="back_start")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="back_start")]
-        ]
+    hits = cache_lookup("hit").value + cache_lookup("similar").value
+    lookups = hits + cache_lookup("miss").value
+    if lookups:
+        lines.append(f"Попадания в кэш ответов: {hits / lookups:.0%} из {lookups}")
 
-        await query.edit_message_text(
-            "Что Вы хотите?",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    text = "\n".join(lines) or "Метрик пока нет."
+
+    # Каждый новый набор меток (роли, модели, этапы) удлиняет список — больше
+    # лимита сообщения отправляем файлом
+    if len(text) <= MESSAGE_LIMIT:
+        await update.message.reply_text(text)
         return
 
-    if data == "back_start":
-        context.user_data.clear()
-        await show_start(update, context, edit=True)
+    await update.message.reply_document(
+        document=io.BytesIO(text.encode("utf-8")),
+        filename=datetime.now().strftime("stats-%Y%m%d-%H%M%S.txt"),
+        caption=f"Метрик: {len(lines)}"
+    )
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if not is_admin(update):
         return
 
-# ================== ОБРАБОТКА ТЕКСТА ==================
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("Использование: /profile <секунды>")
+        return
+    seconds = max(1.0, min(seconds, profiler.MAX_SECONDS))
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if profiler.running():
+        await update.message.reply_text("Профилирование уже идёт.")
+        return
 
-    if context.user_data.get("suggest_mode"):
-        save_to_excel(update.message.from_user, update.message.text)
-        context.user_data["suggest_mode"] = False
-        await update.message.reply_text("Спасибо! Предложение сохранено ✅")
+    await update.message.reply_text(f"Профилирую {seconds:g} с…")
+
+    # Отдельный поток, а не пулы workers: профиль не занимает место у запросов
+    result = await asyncio.to_thread(profiler.sample, seconds)
+    if result is None:
+        await update.message.reply_text("Профилирование уже идёт.")
         return
 
-    if context.user_data.get("ai_mode"):
+    samples, stacks = result
+    top = "\n".join(f"{share:.0%} {name}" for name, share in profiler.top_functions(stacks, 8))
+    await update.message.reply_document(
+        document=io.BytesIO(profiler.collapsed_text(stacks).encode("utf-8")),
+        filename=datetime.now().strftime("profile-%Y%m%d-%H%M%S.collapsed.txt"),
+        caption=(f"Выборок: {samples}. Открыть: speedscope.app\n\n{top}")[:1024]
+    )
 
-        msg = await update.message.reply_text("Анализ нормативной базы...")
+EXPORT_USAGE = (
+    "Использование: /export [suggestions|history] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [user=ID]\n"
+    "Без таблицы выгружаются обе."
+)
 
-        answer = await ask_ai(
-            update.message.from_user.id,
-            update.message.text
-        )
+def parse_export_args(args):
+    tables = []
+    export_filters = {"date_from": None, "date_to": None, "user_id": None}
+
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if arg in excel_export.TABLES:
+            tables.append(arg)
+        elif key == "from":
+            export_filters["date_from"] = excel_export.parse_date(value)
+        elif key == "to":
+            export_filters["date_to"] = excel_export.parse_date(value)
+        elif key == "user":
+            export_filters["user_id"] = int(value)
+        else:
+            raise ValueError(arg)
+
+    return tables or list(excel_export.TABLES), export_filters
+
+def run_export(path, tables, export_filters):
+    with tracing.span("admin_export", ADMIN_EXPORT_TIME), database.reader() as conn:
+        return excel_export.export_xlsx(conn, path, tables, **export_filters)
 
-        await msg.edit_text(answer)
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if not is_admin(update):
+        return
+
+    try:
+        tables, export_filters = parse_export_args(context.args)
+    except ValueError:
+        await update.message.reply_text(EXPORT_USAGE)
         return
 
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        # Чтение порциями и запись книги — в пуле io, цикл событий не блокируется
+        counts = await io_pool.run(run_export, path, tables, export_filters)
+
+        if os.path.getsize(path) > DOCUMENT_LIMIT:
+            await update.message.reply_text("Файл больше 50 МБ — сузьте период или выберите пользователя.")
+            return
+
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=datetime.now().strftime("export-%Y%m%d-%H%M%S.xlsx"),
+                caption=", ".join(f"{table}: {count}" for table, count in counts.items())
+            )
+    except Overloaded:
+        await update.message.reply_text("Сейчас слишком много запросов. Попробуйте, пожалуйста, через минуту.")
+    finally:
+        os.remove(path)
+
+# ================== ТРАССИРОВКА ==================
+
+class TracingRequest(BaseRequest):
+
+    # Обёртка транспорта Bot API: каждый вызов — интервал telegram.<метод> в трассе обновления
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        with tracing.span("telegram." + url.rsplit("/", 1)[-1]):
+            return await self.inner.do_request(url, method, request_data, **timeouts)
+
+def update_name(update: Update):
+    if update.callback_query:
+        return "callback " + (update.callback_query.data or "")
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        return "command " + update.message.text.split()[0]
+    return "message"
+
+async def begin_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    tracing.begin(update_name(update), update_id=update.update_id, user_id=user.id if user else None)
+
+async def finish_trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tracing.finish()
+
 # ================== MAIN ==================
 
-def main():
-    init_ai_db()
-    app = ApplicationBuilder().token(TOKEN).build()
+async def on_startup(app):
+    app.bot_data["export_task"] = asyncio.create_task(export_loop())
+
+async def on_shutdown(app):
+    task = app.bot_data.pop("export_task", None)
+    if task:
+        task.cancel()
+    export_suggestions_file()
+
+    await llm.close()
+    retrieval_pool.shutdown()
+    io_pool.shutdown()
+    database.close()
+    tracing.stop()
+
+def build_application(token, request=None):
+
+    # Обновления разных чатов обрабатываются параллельно;
+    # request — свой транспорт к Bot API (bench_load.py подставляет заглушку)
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .request(TracingRequest(request or HTTPXRequest(connection_pool_size=TELEGRAM_POOL_SIZE)))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Трасса охватывает все группы обработчиков одного обновления
+    app.add_handler(TypeHandler(Update, begin_trace), group=-100)
+    app.add_handler(TypeHandler(Update, finish_trace), group=100)
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(CommandHandler("export", export_command))
     app.add_handler(CallbackQueryHandler(handle_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    return app
+
+def main():
+    init_ai_db()
+
+    # Новые и изменённые PDF — в кэш страниц и векторный индекс параллельно по
+    # процессам; если всё уже загружено, это только сверка файлов
+    load_docs.ingest(PDF_FOLDER)
+
+    # Индексы строятся до приёма сообщений, а не на первом вопросе
+    pdf_index.get_index(PDF_FOLDER)
+    vector_index.load()
+
+    app = build_application(TOKEN)
+    tracing.start()
+
+    if METRICS_PORT:
+        # Занятый порт не повод не запускать бота — работаем без /metrics
+        try:
+            metrics.serve(METRICS_HOST, METRICS_PORT)
+            print(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"Метрики не запущены ({METRICS_HOST}:{METRICS_PORT}):", e)
+
     print("StructAI PRO запущен")
     app.run_polling()
 
@@ -0,0 +1,69 @@
+import time
+
+import metrics
+
+# ================== НАСТРОЙКИ ==================
+
+# Столько ошибок или таймаутов подряд размыкают цепь
+FAILURE_THRESHOLD = 3
+
+# Сколько секунд после размыкания не обращаться к модели вовсе
+OPEN_SECONDS = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE = metrics.gauge("llm_circuit_open", "Цепь к модели разомкнута (1) или пробный запрос (0.5)")
+OPENED = metrics.counter("llm_circuit_opened_total", "Сколько раз цепь размыкалась")
+
+# ================== ПРЕДОХРАНИТЕЛЬ ==================
+
+class CircuitBreaker:
+
+    # closed — запросы идут к модели; open — сразу отказ, ответ только по базе;
+    # half_open — по истечении OPEN_SECONDS пропускается один пробный запрос,
+    # его успех замыкает цепь, ошибка снова размыкает
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._set(HALF_OPEN)
+
+        if self.state == CLOSED:
+            return True
+
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.probing = False
+        self._set(CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            if self.state != OPEN:
+                OPENED.inc()
+            self._set(OPEN)
+
+    def release(self):
+        # Запрос завершился без вердикта о модели (отмена, лимиты)
+        self.probing = False
+
+    def _set(self, state):
+        self.state = state
+        STATE.set({CLOSED: 0, HALF_OPEN: 0.5, OPEN: 1}[state])
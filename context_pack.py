@@ -0,0 +1,126 @@
+import math
+from collections import namedtuple
+
+import pdf_index
+import vector_index
+from pdf_index import tokenize
+from pdf_store import PDF_FOLDER
+
+# ================== НАСТРОЙКИ ==================
+
+# Весь запрос к модели (система + фрагменты + вопрос) укладывается в этот бюджет
+PROMPT_TOKEN_BUDGET = 1600
+
+# Грубая оценка без токенизатора модели: для русского текста ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+# Кандидатов из каждого индекса и минимальный размер обрезанного фрагмента
+CANDIDATES = 8
+MIN_BLOCK_TOKENS = 60
+
+# Фрагменты, совпадающие по словам больше чем на столько, считаются повтором
+DUPLICATE_SIMILARITY = 0.7
+
+Source = namedtuple("Source", "score document page_no text")
+
+# ================== ТОКЕНЫ ==================
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def trim_to_tokens(text, tokens):
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(". ", 0, limit)
+    if cut < limit // 2:
+        cut = text.rfind(" ", 0, limit)
+    return text[:cut + 1 if cut > 0 else limit].rstrip() + " …"
+
+# ================== КАНДИДАТЫ ==================
+
+def best_chunk(question, text):
+    # Из длинной страницы берём фрагмент, где больше всего слов вопроса
+    terms = set(tokenize(question))
+    chunks = vector_index.chunk_text(text)
+    if not chunks:
+        return ""
+    return max(chunks, key=lambda chunk: len(terms & set(tokenize(chunk))))
+
+
+def candidates(question, k=CANDIDATES):
+    # Оценки BM25 и косинусной близости несопоставимы, поэтому каждая
+    # нормируется на лучший результат своего индекса
+    found = []
+
+    hits = pdf_index.search(question, k, folder=PDF_FOLDER)
+    if hits:
+        top = hits[0].score
+        for hit in hits:
+            found.append(Source(hit.score / top, hit.file, hit.page_no, best_chunk(question, hit.text)))
+
+    passages = vector_index.search(question, k)
+    if passages and passages[0].score > 0:
+        top = passages[0].score
+        for passage in passages:
+            found.append(Source(passage.score / top, passage.document, passage.page_no, passage.text))
+
+    found.sort(key=lambda source: source.score, reverse=True)
+    return found
+
+
+def is_contents(text):
+    # Страницы оглавления («6.9 Правила ..... 150») совпадают по словам почти с любым вопросом
+    return text.count("..") * 2 > len(text) / 20
+
+
+def dedupe(sources):
+    kept = []
+    seen_pages = set()
+    seen_terms = []
+
+    for source in sources:
+        if not source.text or is_contents(source.text):
+            continue
+        page = (source.document, source.page_no)
+        if page in seen_pages:
+            continue
+        terms = set(tokenize(source.text))
+        if any(len(terms & other) / max(1, len(terms | other)) >= DUPLICATE_SIMILARITY for other in seen_terms):
+            continue
+        seen_pages.add(page)
+        seen_terms.append(terms)
+        kept.append(source)
+
+    return kept
+
+# ================== УПАКОВКА ==================
+
+def cite(source):
+    if source.page_no is None:
+        return source.document
+    return f"{source.document}, стр. {source.page_no + 1}"
+
+
+def pack_context(question, reserved_tokens, budget=PROMPT_TOKEN_BUDGET):
+    # reserved_tokens — системная инструкция и сам вопрос; остальное — фрагменты по убыванию оценки
+    left = budget - reserved_tokens
+    blocks = []
+    used = []
+
+    for source in dedupe(candidates(question)):
+        header = f"[{len(used) + 1}] {cite(source)}\n"
+        room = left - estimate_tokens(header)
+        if room < MIN_BLOCK_TOKENS:
+            break
+        text = trim_to_tokens(source.text, room)
+        blocks.append(header + text)
+        used.append(source)
+        left -= estimate_tokens(header + text) + 1
+
+    return "\n\n".join(blocks), used
+
+
+def format_sources(sources):
+    return "\n".join(f"[{i}] {cite(source)}" for i, source in enumerate(sources, 1))
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# ================== НАСТРОЙКИ ==================
+
+# Переопределяется для прогонов на копии базы (bench_load.py)
+DB_FILE = os.getenv("DB_FILE", "structai_ai.db")
+
+READ_POOL_SIZE = 4
+
+# Сколько записей максимум объединяется в одну транзакцию
+WRITE_BATCH = 100
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA foreign_keys = ON",
+)
+
+# ================== СОЕДИНЕНИЯ ==================
+
+def connect(path=DB_FILE):
+    # isolation_level=None: транзакциями управляем сами (BEGIN/COMMIT писателя)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class Database:
+
+    # Долгоживущие соединения: пул читателей и один поток-писатель,
+    # который собирает накопившиеся записи в групповую транзакцию
+
+    def __init__(self, path=DB_FILE, readers=READ_POOL_SIZE):
+        self.path = path
+        self.readers = readers
+        self._idle = queue.Queue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = None
+
+    # ---------- чтение ----------
+
+    @contextmanager
+    def reader(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.readers:
+                self._opened += 1
+                return connect(self.path)
+
+        return self._idle.get()
+
+    # ---------- запись ----------
+
+    def write(self, fn, *args):
+        # fn(conn, *args) выполняется в потоке писателя внутри общей транзакции
+        # и не должна сама вызывать commit
+        future = Future()
+
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+                self._writer.start()
+
+        self._writes.put((fn, args, future))
+        return future
+
+    async def write_async(self, fn, *args):
+        return await asyncio.wrap_future(self.write(fn, *args))
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        stop = False
+
+        while not stop:
+            item = self._writes.get()
+            if item is None:
+                break
+
+            batch = [item]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._commit_batch(conn, batch)
+
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        results = []
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        # Ошибка одной записи откатывает только её, а не всю группу
+        for fn, args, future in batch:
+            conn.execute("SAVEPOINT item")
+            try:
+                results.append((future, fn(conn, *args), None))
+                conn.execute("RELEASE item")
+            except Exception as e:
+                conn.execute("ROLLBACK TO item")
+                conn.execute("RELEASE item")
+                results.append((future, None, e))
+
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, _, _ in results:
+                future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    # ---------- завершение ----------
+
+    def close(self):
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._opened = 0
+
+
+database = Database()
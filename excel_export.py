@@ -0,0 +1,83 @@
+import os
+from datetime import date, timedelta
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+# ================== НАСТРОЙКИ ==================
+
+# Строк за один запрос к SQLite: в памяти одновременно не больше одной порции
+EXPORT_CHUNK = 1000
+
+# Ограничение Excel на длину текста в ячейке
+CELL_LIMIT = 32767
+
+# Таблица: лист, заголовок, выбираемые столбцы
+TABLES = {
+    "suggestions": ("Предложения", ["Дата", "Username", "User ID", "Текст"], "date, username, user_id, text"),
+    "history": ("История", ["Дата", "User ID", "Вопрос", "Ответ"], "date, user_id, question, answer"),
+}
+
+# ================== ЧТЕНИЕ ПОРЦИЯМИ ==================
+
+def iter_rows(conn, table, date_from=None, date_to=None, user_id=None, chunk=EXPORT_CHUNK):
+    # Постраничное чтение по id (keyset): каждая порция — отдельный короткий SELECT,
+    # без OFFSET и без долгой читающей транзакции, которая мешала бы WAL
+    _, _, columns = TABLES[table]
+
+    where = ["id > ?"]
+    params = []
+    if date_from:
+        where.append("date >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        # Даты хранятся строками «ГГГГ-ММ-ДД ЧЧ:ММ:СС», конец периода включительно
+        where.append("date < ?")
+        params.append((date_to + timedelta(days=1)).isoformat())
+    if user_id is not None:
+        where.append("user_id = ?")
+        params.append(user_id)
+
+    sql = f"SELECT id, {columns} FROM {table} WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+
+    last = 0
+    while True:
+        rows = conn.execute(sql, [last] + params + [chunk]).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row[1:]
+        last = rows[-1][0]
+
+
+def cell(value):
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub("", value)[:CELL_LIMIT]
+    return value
+
+# ================== ВЫГРУЗКА ==================
+
+def export_xlsx(conn, path, tables, date_from=None, date_to=None, user_id=None):
+    # Книга write_only не держит листы в памяти: строки сразу уходят во временный XML.
+    # Файл появляется по пути path только целиком (os.replace)
+    wb = Workbook(write_only=True)
+    counts = {}
+
+    for table in tables:
+        title, header, _ = TABLES[table]
+        ws = wb.create_sheet(title)
+        ws.append(header)
+
+        counts[table] = 0
+        for row in iter_rows(conn, table, date_from, date_to, user_id):
+            ws.append([cell(value) for value in row])
+            counts[table] += 1
+
+    tmp = path + ".tmp"
+    wb.save(tmp)
+    os.replace(tmp, path)
+    return counts
+
+
+def parse_date(text):
+    return date.fromisoformat(text)
@@ -0,0 +1,261 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ================== НАСТРОЙКИ ==================
+
+# Локальная замена OpenRouter для нагрузочных прогонов без сети:
+#   python fake_llm.py --latency 0.8 --tps 40 --error-rate 0.02
+#   LLM_BASE_URL=http://127.0.0.1:8010/v1 OPENAI_API_KEY=fake python bot.py
+
+HOST = "127.0.0.1"
+PORT = 8010
+
+WORDS = (
+    "расчётное значение нагрузки определяется по формуле с учётом коэффициента "
+    "надёжности и сочетания воздействий для предельного состояния несущей способности "
+    "согласно пункту нормы принимается характеристическое значение"
+).split()
+
+# ================== ПОВЕДЕНИЕ ==================
+
+class Behaviour:
+
+    def __init__(self, args):
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.distribution = args.distribution
+        self.tps = args.tps
+        self.tokens = args.tokens
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.rpm = args.rpm
+        self.model_latency = dict(args.model_latency)
+        self.random = random.Random(args.seed)
+
+        self._lock = threading.Lock()
+        self._window = []
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "tokens": 0}
+
+    def first_token_delay(self, model):
+        # Задержка до первого токена: fixed — ровно latency,
+        # uniform — latency ± jitter, lognormal — медиана latency с длинным хвостом
+        latency = self.model_latency.get(model, self.latency)
+        with self._lock:
+            if self.distribution == "uniform":
+                return max(0.0, self.random.uniform(latency - self.jitter, latency + self.jitter))
+            if self.distribution == "lognormal":
+                return self.random.lognormvariate(0, self.jitter) * latency
+        return latency
+
+    def verdict(self):
+        # None — отвечать, иначе (код, сообщение)
+        now = time.monotonic()
+        with self._lock:
+            self.stats["requests"] += 1
+
+            if self.rpm:
+                self._window = [t for t in self._window if now - t < 60]
+                if len(self._window) >= self.rpm:
+                    self.stats["rate_limited"] += 1
+                    return 429, "Rate limit exceeded: requests per minute"
+                self._window.append(now)
+
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return 429, "Rate limit exceeded"
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return 500, "Upstream provider error"
+
+        return None
+
+    def answer(self):
+        with self._lock:
+            words = [self.random.choice(WORDS) for _ in range(self.tokens)]
+        return [word + " " for word in words]
+
+    def count(self, tokens):
+        with self._lock:
+            self.stats["ok"] += 1
+            self.stats["tokens"] += tokens
+
+# ================== HTTP ==================
+
+class Handler(BaseHTTPRequestHandler):
+
+    # HTTP/1.1 и chunked-ответы: клиент держит keep-alive соединения, как с настоящим API
+    protocol_version = "HTTP/1.1"
+    behaviour = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = [{"id": model, "object": "model"} for model in self.behaviour.model_latency]
+            self._json(200, {"object": "list", "data": models})
+        else:
+            self._error(404, "Not found")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._error(404, "Not found")
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._error(400, "Invalid JSON")
+            return
+
+        model = body.get("model", "fake")
+        messages = body.get("messages") or [{}]
+        question = messages[-1].get("content", "")
+
+        verdict = self.behaviour.verdict()
+        time.sleep(self.behaviour.first_token_delay(model))
+        if verdict:
+            self._error(*verdict)
+            return
+
+        tokens = self.behaviour.answer()[:body.get("max_tokens") or None]
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        created = int(time.time())
+
+        try:
+            if body.get("stream"):
+                include_usage = (body.get("stream_options") or {}).get("include_usage")
+                self._stream(completion_id, created, model, tokens, usage(question, tokens) if include_usage else None)
+            else:
+                self._complete(completion_id, created, model, tokens, question)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент отменил запрос (хеджирование, таймаут) — это нормально
+            return
+
+        self.behaviour.count(len(tokens))
+
+    def _complete(self, completion_id, created, model, tokens, question):
+        time.sleep(len(tokens) / self.behaviour.tps)
+        self._json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop"
+            }],
+            "usage": usage(question, tokens)
+        })
+
+    def _stream(self, completion_id, created, model, tokens, totals=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, **extra):
+            self._chunk("data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+                **extra
+            }, ensure_ascii=False) + "\n\n")
+
+        def delta(content, finish_reason=None):
+            event([{"index": 0, "delta": content, "finish_reason": finish_reason}])
+
+        delta({"role": "assistant", "content": ""})
+        interval = 1 / self.behaviour.tps
+        for token in tokens:
+            delta({"content": token})
+            time.sleep(interval)
+        delta({}, "stop")
+        # Как у OpenAI при stream_options.include_usage: отдельный чанк без choices
+        if totals:
+            event([], usage=totals)
+        self._chunk("data: [DONE]\n\n")
+        self._chunk("")
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status, payload, headers=()):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        headers = [("Retry-After", "1")] if status == 429 else []
+        self._json(status, {"error": {"message": message, "code": status}}, headers)
+
+
+def usage(question, tokens):
+    prompt = len(question.split())
+    return {"prompt_tokens": prompt, "completion_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+# ================== ЗАПУСК ==================
+
+def model_latency(value):
+    model, _, seconds = value.rpartition("=")
+    if not model:
+        raise argparse.ArgumentTypeError("ожидается МОДЕЛЬ=СЕКУНДЫ")
+    return model, float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер для нагрузочных тестов")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=0.5, help="секунды до первого токена (медиана)")
+    parser.add_argument("--jitter", type=float, default=0.5, help="разброс: ± секунды для uniform, sigma для lognormal")
+    parser.add_argument("--distribution", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--model-latency", type=model_latency, action="append", default=[],
+                        help="своя задержка для модели, МОДЕЛЬ=СЕКУНДЫ (можно несколько)")
+    parser.add_argument("--tps", type=float, default=50, help="токенов в секунду при выдаче ответа")
+    parser.add_argument("--tokens", type=int, default=120, help="длина ответа в токенах")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rpm", type=int, default=0, help="лимит запросов в минуту, сверх него 429 (0 — без лимита)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="печатать каждый запрос")
+    args = parser.parse_args()
+
+    Handler.behaviour = Behaviour(args)
+    Handler.verbose = args.verbose
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"Fake LLM: http://{args.host}:{args.port}/v1")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(Handler.behaviour.stats)
+
+
+if __name__ == "__main__":
+    main()
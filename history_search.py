@@ -0,0 +1,111 @@
+from collections import namedtuple
+
+from pdf_index import tokenize
+
+# ================== НАСТРОЙКИ ==================
+
+# Насколько совпадающими должны быть вопросы, чтобы переиспользовать ответ
+REUSE_SIMILARITY = 0.8
+
+HistoryHit = namedtuple("HistoryHit", "id user_id question answer date rank")
+
+# ================== ПОЛНОТЕКСТОВЫЙ ИНДЕКС ==================
+
+def init_history_fts(conn):
+    c = conn.cursor()
+
+    exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'"
+    ).fetchone()
+
+    # Внешний контент: текст хранится только в history, индекс обновляют триггеры
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            question,
+            answer,
+            content = 'history',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts (rowid, question, answer)
+            VALUES (new.id, new.question, new.answer);
+        END
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, question, answer)
+            VALUES ('delete', old.id, old.question, old.answer);
+        END
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_fts_update AFTER UPDATE ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, question, answer)
+            VALUES ('delete', old.id, old.question, old.answer);
+            INSERT INTO history_fts (rowid, question, answer)
+            VALUES (new.id, new.question, new.answer);
+        END
+    """)
+
+    # Уже накопленная история индексируется один раз при создании таблицы
+    if not exists:
+        c.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+
+    conn.commit()
+
+# ================== ПОИСК ==================
+
+def match_query(text):
+    # Основы слов с префиксным поиском: «сейсмическ*» найдёт все формы слова
+    terms = dict.fromkeys(tokenize(text))
+    return " OR ".join('"' + term.replace('"', "") + '"*' for term in terms)
+
+
+def search_history(conn, text, limit=5):
+    query = match_query(text)
+    if not query:
+        return []
+
+    # Совпадение в вопросе весит больше, чем в ответе
+    rows = conn.execute(
+        """
+        SELECT h.id, h.user_id, h.question, h.answer, h.date,
+               bm25(history_fts, 2.0, 1.0) AS rank
+        FROM history_fts
+        JOIN history h ON h.id = history_fts.rowid
+        WHERE history_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+        """,
+        (query, limit)
+    ).fetchall()
+
+    return [HistoryHit(*row) for row in rows]
+
+
+def is_code(term):
+    # Числа и обозначения (DCM, γM0, STR, 8 баллов, EN 1993) — латиница,
+    # греческие буквы или цифры; всё остальное после tokenize — кириллица
+    return any(ch.isdigit() or (ch.isalpha() and not "а" <= ch <= "я") for ch in term)
+
+
+def find_similar_answer(conn, question, limit=5):
+    # Ответ на почти такой же вопрос, если вопросы отличаются только словами;
+    # другой класс, район, коэффициент или норма — уже другой вопрос
+    terms = set(tokenize(question))
+    if not terms:
+        return None
+
+    for hit in search_history(conn, question, limit):
+        other = set(tokenize(hit.question or ""))
+        if not other or any(is_code(term) for term in terms ^ other):
+            continue
+        if len(terms & other) / len(terms | other) >= REUSE_SIMILARITY:
+            return hit
+
+    return None
@@ -0,0 +1,299 @@
+import asyncio
+import os
+import random
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+import metrics
+
+# ================== НАСТРОЙКИ ==================
+
+OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+
+# Для прогонов без сети указывается локальный fake_llm.py: http://127.0.0.1:8010/v1
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_MODEL = "mistralai/mistral-7b-instruct"
+
+# Резервные модели в порядке предпочтения
+FALLBACK_MODELS = ("meta-llama/llama-3.1-8b-instruct",)
+
+# Если основная модель не выдала первый токен за это время — параллельно
+# запрашивается следующая, ответ берётся у той, что начнёт раньше
+FIRST_TOKEN_BUDGET = 4.0
+
+# Сглаживание статистики моделей (EWMA) и штраф за долю ошибок при выборе маршрута
+STATS_ALPHA = 0.2
+ERROR_PENALTY = 4.0
+
+# Статистика, которая давно не обновлялась, затухает к порядку из настроек
+# с этим периодом полураспада, секунды
+STATS_HALF_LIFE = 300
+
+# Доля запросов, которые идут в порядке из настроек, а не по статистике, —
+# так медленная в прошлом модель снова получает шанс показать себя
+EXPLORE_RATE = 0.05
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 60.0
+
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE = 16
+KEEPALIVE_EXPIRY = 60.0
+
+SYSTEM_PROMPT = """Ты инженерный ассистент по Еврокодам EN 1990–1999.
+Используй нормативную базу.
+Не выдумывай пункты норм.
+Если вопрос вне проектирования — сообщи об этом."""
+
+CONTEXT_PROMPT = """Фрагменты нормативной базы:
+
+{context}
+
+Отвечай по этим фрагментам и ссылайся на них номерами в квадратных скобках, например [1].
+Если во фрагментах ответа нет — так и скажи."""
+
+# Длинный вопрос обрезается, чтобы размер запроса оставался предсказуемым
+MAX_QUESTION_CHARS = 2000
+
+# ================== AI CLIENT ==================
+
+# Один общий пул keep-alive соединений на весь бот:
+# запросы разных пользователей идут параллельно и не открывают TLS заново
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    ),
+    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+)
+
+ai_client = AsyncOpenAI(
+    api_key=OPENAI_KEY,
+    base_url=LLM_BASE_URL,
+    http_client=http_client,
+    max_retries=1
+)
+
+
+def build_messages(question, context=None):
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system", "content": CONTEXT_PROMPT.format(context=context)})
+    messages.append({"role": "user", "content": question[:MAX_QUESTION_CHARS]})
+    return messages
+
+
+def prompt_overhead(question):
+    # Текст запроса без фрагментов — для расчёта оставшегося бюджета
+    return SYSTEM_PROMPT + CONTEXT_PROMPT.format(context="") + question[:MAX_QUESTION_CHARS]
+
+
+async def stream_model(model, question, context=None):
+    # Асинхронный генератор фрагментов ответа по мере генерации
+    response = await ai_client.chat.completions.create(
+        model=model,
+        messages=build_messages(question, context),
+        temperature=0.2,
+        max_tokens=900,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    usage = None
+    chunks = 0
+    async with response:
+        async for chunk in response:
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks += 1
+                yield chunk.choices[0].delta.content
+
+    # Без usage от провайдера считаем фрагменты потока — обычно по токену в каждом
+    count_tokens(model, usage.prompt_tokens if usage else 0, usage.completion_tokens if usage else chunks)
+
+
+def count_tokens(model, prompt, completion):
+    metrics.counter("llm_tokens_total", "Токены модели", {"model": model, "type": "prompt"}).inc(prompt)
+    metrics.counter("llm_tokens_total", "Токены модели", {"model": model, "type": "completion"}).inc(completion)
+
+# ================== МАРШРУТИЗАЦИЯ МОДЕЛЕЙ ==================
+
+HEDGES = metrics.counter("llm_hedged_total", "Запросы, продублированные резервной модели")
+
+
+class ModelStats:
+
+    def __init__(self, model):
+        self.model = model
+        self.first_token = None
+        self.error_rate = 0.0
+        self.updated = time.monotonic()
+        self.first_token_hist = metrics.histogram(
+            "llm_first_token_seconds", "Время до первого токена", {"model": model}
+        )
+        self.requests = metrics.counter("llm_requests_total", "Запросы к модели", {"model": model})
+        self.errors = metrics.counter("llm_errors_total", "Ошибки модели", {"model": model})
+
+    def success(self, first_token):
+        self.first_token_hist.observe(first_token)
+        self.latency(first_token)
+        self.error_rate *= 1 - STATS_ALPHA
+
+    def latency(self, seconds):
+        self.updated = time.monotonic()
+        if self.first_token is None:
+            self.first_token = seconds
+        else:
+            self.first_token += STATS_ALPHA * (seconds - self.first_token)
+
+    def failure(self):
+        self.errors.inc()
+        self.updated = time.monotonic()
+        self.error_rate += STATS_ALPHA * (1 - self.error_rate)
+
+    def score(self, default):
+        # Без свежих замеров модель постепенно возвращается на место из настроек:
+        # иначе после одного проигранного дублирования её больше не спросили бы
+        weight = 0.5 ** ((time.monotonic() - self.updated) / STATS_HALF_LIFE)
+        latency = default
+        if self.first_token is not None:
+            latency += weight * (self.first_token - default)
+        return latency * (1 + ERROR_PENALTY * self.error_rate * weight)
+
+
+class _Attempt:
+
+    # Один запрос к одной модели: фрагменты складываются в очередь,
+    # first завершается с первым токеном (или ошибкой)
+
+    def __init__(self, model, question, context, stats):
+        stats.requests.inc()
+        self.model = model
+        self.started = time.monotonic()
+        self.first = asyncio.get_running_loop().create_future()
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run(question, context))
+
+    async def _run(self, question, context):
+        try:
+            async for delta in stream_model(self.model, question, context):
+                if not self.first.done():
+                    self.first.set_result(time.monotonic() - self.started)
+                await self.queue.put(delta)
+            if not self.first.done():
+                self.first.set_result(time.monotonic() - self.started)
+            await self.queue.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self.first.done():
+                self.first.set_exception(e)
+            await self.queue.put(e)
+
+    def cancel(self):
+        self.task.cancel()
+
+
+class ModelRouter:
+
+    def __init__(self, models, budget=FIRST_TOKEN_BUDGET):
+        self.models = list(models)
+        self.budget = budget
+        self.stats = {model: ModelStats(model) for model in self.models}
+
+    def route(self):
+        # Без статистики — порядок из настроек; дальше — по задержке и ошибкам.
+        # Изредка порядок из настроек берётся нарочно: медленная модель всё равно
+        # ограничена бюджетом первого токена, а её статистика обновится
+        if random.random() < EXPLORE_RATE:
+            return list(self.models)
+        return sorted(
+            self.models,
+            key=lambda model: self.stats[model].score(self.budget * (1 + self.models.index(model)))
+        )
+
+    def _attempt(self, model, question, context):
+        return _Attempt(model, question, context, self.stats[model])
+
+    async def _first_winner(self, question, context):
+        queue = self.route()
+        attempts = [self._attempt(queue.pop(0), question, context)]
+        alive = list(attempts)
+
+        try:
+            while True:
+                # Пока есть резерв, ждём первый токен не дольше бюджета
+                timeout = self.budget if queue else None
+                done, _ = await asyncio.wait(
+                    [attempt.first for attempt in alive],
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    HEDGES.inc()
+                    attempt = self._attempt(queue.pop(0), question, context)
+                    attempts.append(attempt)
+                    alive.append(attempt)
+                    continue
+
+                for attempt in list(alive):
+                    if not attempt.first.done():
+                        continue
+                    if attempt.first.exception() is None:
+                        self.stats[attempt.model].success(attempt.first.result())
+                        return attempt, attempts
+                    self.stats[attempt.model].failure()
+                    alive.remove(attempt)
+                    error = attempt.first.exception()
+
+                # Все запущенные упали — сразу переходим к следующей модели
+                if not alive:
+                    if not queue:
+                        raise error
+                    attempt = self._attempt(queue.pop(0), question, context)
+                    attempts.append(attempt)
+                    alive.append(attempt)
+        except BaseException:
+            for attempt in attempts:
+                attempt.cancel()
+            raise
+
+    async def stream(self, question, context=None):
+        winner, attempts = await self._first_winner(question, context)
+
+        # Более медленные запросы больше не нужны; их задержка учитывается
+        # хотя бы как «не меньше, чем уже прошло»
+        for attempt in attempts:
+            if attempt is not winner:
+                if not attempt.first.done():
+                    self.stats[attempt.model].latency(time.monotonic() - attempt.started)
+                attempt.cancel()
+
+        try:
+            while True:
+                item = await winner.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    self.stats[winner.model].failure()
+                    raise item
+                yield item
+        finally:
+            winner.cancel()
+
+
+router = ModelRouter((LLM_MODEL,) + FALLBACK_MODELS)
+
+
+async def stream(question, context=None):
+    async for delta in router.stream(question, context):
+        yield delta
+
+
+async def close():
+    await ai_client.close()
@@ -1,4 +1,179 @@
-from bot import add_document
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-with open("EN1990.txt", "r", encoding="utf-8") as f:
-    add_document("EN1990", f.read())
\ No newline at end of file
+import numpy as np
+import PyPDF2
+
+import pdf_store
+import vector_index
+
+# ================== НАСТРОЙКИ ==================
+
+# Как часто фиксировать результат на диске (страниц)
+COMMIT_EVERY = 25
+
+# ================== РАБОЧИЙ ПРОЦЕСС ==================
+
+# PdfReader открывается один раз на файл в каждом процессе пула
+_readers = {}
+
+
+def process_page(path, page_no):
+    reader = _readers.get(path)
+    if reader is None:
+        reader = _readers[path] = PyPDF2.PdfReader(path)
+
+    text = pdf_store.normalize_text(reader.pages[page_no].extract_text() or "")
+    chunks = vector_index.chunk_text(text)
+    vectors = [vector_index.embed(chunk) for chunk in chunks]
+
+    return path, page_no, text, chunks, vectors
+
+# ================== ПЛАН ЗАГРУЗКИ ==================
+
+def plan(conn, paths, reset=False):
+    # Список (путь, страница), которых ещё нет в кэше страниц или в векторном индексе
+    tasks = []
+    pending_docs = []
+
+    for path in paths:
+        try:
+            missing, pending = plan_document(conn, path, reset)
+        except Exception as e:
+            # Нечитаемый файл (обрезан, повреждён) выпадает из поиска, остальные загружаются
+            print(f"Не удалось прочитать {path}:", e)
+            pdf_store.drop_document(conn, path)
+            vector_index.remove_document(os.path.basename(path), save=False)
+            continue
+
+        if pending:
+            pending_docs.append(path)
+        tasks.extend((path, page_no) for page_no in missing)
+
+    return tasks, pending_docs
+
+
+def plan_document(conn, path, reset=False):
+    # Номера страниц к обработке и нужно ли потом отметить документ загруженным
+    name = os.path.basename(path)
+
+    if reset:
+        conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+        conn.commit()
+
+    # Страницы без текста во фрагменты не попадают — их в индексе и не ищем
+    if pdf_store.is_fresh(conn, path):
+        with_text = pdf_store.stored_pages(conn, path, non_empty=True)
+        indexed = vector_index.indexed_pages(name)
+        return sorted(with_text - indexed), False
+
+    page_count = len(PyPDF2.PdfReader(path).pages)
+    pdf_store.begin_document(conn, path, pdf_store.file_hash(path), page_count)
+    stored = pdf_store.stored_pages(conn, path)
+    if not stored:
+        # Файл новый или изменился — старые фрагменты в индексе больше не нужны
+        vector_index.remove_document(name, save=False)
+    with_text = pdf_store.stored_pages(conn, path, non_empty=True)
+    indexed = vector_index.indexed_pages(name)
+    missing = [
+        i for i in range(page_count)
+        if i not in stored or (i in with_text and i not in indexed)
+    ]
+    return missing, True
+
+# ================== ПРОГРЕСС ==================
+
+def report(done, total, started):
+    elapsed = time.time() - started
+    speed = done / elapsed if elapsed else 0
+    left = (total - done) / speed if speed else 0
+    percent = 100 * done // total if total else 100
+    print(
+        f"\r[{done}/{total}] {percent}% — {speed:.1f} стр/с, осталось ~{left:.0f} с",
+        end="",
+        flush=True
+    )
+
+# ================== ЗАГРУЗКА ==================
+
+def ingest(folder=pdf_store.PDF_FOLDER, workers=None, reset=False):
+    conn = pdf_store.connect()
+    paths = pdf_store.list_pdfs(folder)
+
+    tasks, pending_docs = plan(conn, paths, reset)
+
+    if not tasks and not pending_docs:
+        print("Все документы уже загружены")
+        conn.close()
+        return
+
+    print(f"Документов: {len(paths)}, страниц к обработке: {len(tasks)}")
+
+    started = time.time()
+    done = 0
+    failed = set()
+    pool = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        futures = {pool.submit(process_page, path, page_no): (path, page_no) for path, page_no in tasks}
+
+        for future in as_completed(futures):
+            done += 1
+            try:
+                path, page_no, text, chunks, vectors = future.result()
+            except Exception as e:
+                # Страница не извлеклась — документ остаётся незавершённым,
+                # следующий запуск попробует её снова
+                path, page_no = futures[future]
+                print(f"\nНе удалось обработать {path}, стр. {page_no + 1}:", e)
+                failed.add(path)
+                continue
+
+            name = os.path.basename(path)
+
+            # Сначала убираем следы прерванной загрузки этой страницы
+            vector_index.remove_document(name, page_no, save=False)
+            if chunks:
+                vector_index.add_chunks(name, page_no, chunks, np.stack(vectors), save=False)
+            pdf_store.store_page(conn, path, page_no, text)
+
+            if done % COMMIT_EVERY == 0 or done == len(tasks):
+                conn.commit()
+                vector_index.save()
+                report(done, len(tasks), started)
+
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        conn.commit()
+        vector_index.save()
+        conn.close()
+        print(f"\nПрервано. Сохранено страниц: {done}. Повторный запуск продолжит загрузку.")
+        sys.exit(1)
+
+    pool.shutdown()
+    conn.commit()
+    vector_index.save()
+
+    for path in pending_docs:
+        if path not in failed:
+            pdf_store.finish_document(conn, path)
+    conn.close()
+
+    print(f"\nГотово за {time.time() - started:.1f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка PDF из pdf_db в кэш страниц и векторный индекс")
+    parser.add_argument("--folder", default=pdf_store.PDF_FOLDER)
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — по числу ядер)")
+    parser.add_argument("--reset", action="store_true", help="обработать все файлы заново")
+    args = parser.parse_args()
+
+    ingest(args.folder, args.workers, args.reset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ================== МЕТРИКИ ==================
+
+# Простейший реестр счётчиков, показателей и гистограмм в памяти процесса
+
+_lock = threading.Lock()
+REGISTRY = {}
+
+# Границы корзин гистограмм времени, секунды
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Сколько последних наблюдений хранить для перцентилей
+RESERVOIR = 1024
+
+
+def _full_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+    def describe(self):
+        return str(self.value)
+
+
+class Gauge(Counter):
+
+    def dec(self, amount=1):
+        with _lock:
+            self.value -= amount
+
+    def set(self, value):
+        with _lock:
+            self.value = value
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=None, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RESERVOIR)
+
+    def observe(self, value):
+        with _lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.recent.append(value)
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def percentile(self, q):
+        # Перцентиль по последним RESERVOIR наблюдениям
+        with _lock:
+            values = sorted(self.recent)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+    def describe(self):
+        avg = self.sum / self.count if self.count else 0
+        return (
+            f"count={self.count} avg={avg:.3f} "
+            f"p50={self.percentile(50):.3f} p95={self.percentile(95):.3f} p99={self.percentile(99):.3f}"
+        )
+
+
+def _register(cls, name, help, labels=None, **kwargs):
+    key = _full_name(name, labels)
+    with _lock:
+        metric = REGISTRY.get(key)
+        if metric is None:
+            metric = REGISTRY[key] = cls(name, help, labels, **kwargs)
+        return metric
+
+
+def counter(name, help="", labels=None):
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help="", labels=None):
+    return _register(Gauge, name, help, labels)
+
+
+def histogram(name, help="", labels=None, buckets=TIME_BUCKETS):
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def snapshot():
+    with _lock:
+        items = sorted(REGISTRY.items())
+    return [(key, metric.describe()) for key, metric in items]
+
+
+# ================== ЭКСПОЗИЦИЯ PROMETHEUS ==================
+
+def _escape(value, quotes=True):
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _labels(labels, **extra):
+    items = sorted(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _type(metric):
+    if isinstance(metric, Histogram):
+        return "histogram"
+    if isinstance(metric, Gauge):
+        return "gauge"
+    return "counter"
+
+
+def exposition():
+    # Текстовый формат Prometheus 0.0.4: метрики с одним именем и разными метками — одно семейство
+    with _lock:
+        families = {}
+        for metric in REGISTRY.values():
+            families.setdefault(metric.name, []).append(metric)
+
+        lines = []
+        for name in sorted(families):
+            members = families[name]
+            lines.append(f"# HELP {name} {_escape(members[0].help, quotes=False)}")
+            lines.append(f"# TYPE {name} {_type(members[0])}")
+
+            for metric in members:
+                if not isinstance(metric, Histogram):
+                    lines.append(f"{name}{_labels(metric.labels)} {metric.value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(metric.labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(metric.labels, le='+Inf')} {metric.count}")
+                lines.append(f"{name}_sum{_labels(metric.labels)} {metric.sum}")
+                lines.append(f"{name}_count{_labels(metric.labels)} {metric.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host, port):
+    # /metrics в отдельном потоке рядом с run_polling; цикл событий бота не затрагивается
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,120 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict, namedtuple
+
+from pdf_store import PDF_FOLDER, get_pages
+
+# ================== НАСТРОЙКИ ==================
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+Hit = namedtuple("Hit", "score file page_no text coverage matched")
+
+# ================== ТОКЕНИЗАЦИЯ ==================
+
+TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)+|\w+")
+
+STOPWORDS = {
+    "и", "в", "во", "на", "по", "к", "ко", "с", "со", "о", "об", "от", "до",
+    "из", "за", "для", "при", "не", "ни", "что", "как", "это", "или", "а",
+    "но", "же", "ли", "бы", "то", "у", "так", "его", "ее", "их", "он", "она",
+    "они", "мы", "вы", "я", "какой", "какая", "какие", "каков", "где",
+    "когда", "чем", "the", "of", "and", "to", "in", "for", "is", "a",
+}
+
+# Грубый стемминг: окончания русских слов, от длинных к коротким
+ENDINGS = sorted("""
+    иями ями ами ией иях ого его ому ему ыми ими ах ях ой ей ий ый ая яя ое ее
+    ые ие ую юю ом ем ам ям ов ев ью ия ть ться ет ют ат ят ит ишь ешь ся сь
+    а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+
+MIN_STEM = 4
+
+
+def stem(word):
+    if word.isdigit() or not word.isalpha():
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    text = text.lower().replace("ё", "е")
+    return [
+        stem(token)
+        for token in TOKEN_RE.findall(text)
+        if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+# ================== ИНДЕКС ==================
+
+class BM25Index:
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.postings = defaultdict(list)
+        self.lengths = []
+
+        for doc_id, (file, page_no, text) in enumerate(pages):
+            counts = Counter(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_id, tf))
+
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        self.idf = {
+            term: math.log(1 + (len(pages) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, question, k=5):
+        terms = set(tokenize(question))
+        if not terms or not self.pages:
+            return []
+
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[doc_id] += 1
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+        return [
+            Hit(score, *self.pages[doc_id], matched[doc_id] / len(terms), matched[doc_id])
+            for doc_id, score in top
+        ]
+
+# ================== ДОСТУП ==================
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_index(folder=PDF_FOLDER):
+    # get_pages возвращает тот же список, пока файлы не изменились,
+    # поэтому индекс перестраивается только вместе с кэшем страниц
+    global _index
+
+    pages = get_pages(folder)
+
+    with _lock:
+        if _index is None or _index.pages is not pages:
+            _index = BM25Index(pages)
+        return _index
+
+
+def search(question, k=5, folder=PDF_FOLDER):
+    return get_index(folder).search(question, k)
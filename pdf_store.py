@@ -0,0 +1,253 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+
+# ================== НАСТРОЙКИ ==================
+
+PDF_FOLDER = "pdf_db"
+STORE_FILE = "pdf_cache.db"
+
+# Увеличивать при изменении формата хранимого текста — кэш пересоберётся
+STORE_VERSION = "2"
+
+# ================== ХРАНИЛИЩЕ ==================
+
+_lock = threading.Lock()
+_pages = None
+_signature = None
+
+
+def connect(store_file=STORE_FILE):
+    conn = sqlite3.connect(store_file)
+    init_store(conn)
+    return conn
+
+
+def init_store(conn):
+    c = conn.cursor()
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            sha256 TEXT,
+            page_count INTEGER,
+            complete INTEGER DEFAULT 0
+        )
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+            path TEXT,
+            page_no INTEGER,
+            text TEXT,
+            PRIMARY KEY (path, page_no)
+        )
+    """)
+
+    row = c.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None or row[0] != STORE_VERSION:
+        c.execute("DELETE FROM pages")
+        c.execute("DELETE FROM documents")
+        c.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+            (STORE_VERSION,)
+        )
+
+    conn.commit()
+
+# ================== КЛЮЧ ФАЙЛА ==================
+
+def list_pdfs(folder=PDF_FOLDER):
+
+    if not os.path.exists(folder):
+        return []
+
+    return sorted(
+        os.path.join(folder, file)
+        for file in os.listdir(folder)
+        if file.endswith(".pdf")
+    )
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_fresh(conn, path):
+    # Быстрая проверка по размеру и mtime, при расхождении — по содержимому
+    # (после деплоя mtime меняется, а сам файл остаётся прежним)
+    row = conn.execute(
+        "SELECT size, mtime_ns, sha256, complete FROM documents WHERE path = ?",
+        (path,)
+    ).fetchone()
+
+    if row is None or not row[3]:
+        return False
+
+    st = os.stat(path)
+    if (row[0], row[1]) == (st.st_size, st.st_mtime_ns):
+        return True
+
+    if file_hash(path) != row[2]:
+        return False
+
+    conn.execute(
+        "UPDATE documents SET size = ?, mtime_ns = ? WHERE path = ?",
+        (st.st_size, st.st_mtime_ns, path)
+    )
+    conn.commit()
+    return True
+
+# ================== ИЗВЛЕЧЕНИЕ ТЕКСТА ==================
+
+def normalize_text(text):
+    # Склеиваем переносы «конструк-\nции», убираем лишние пробелы и пустые строки
+    text = text.replace("\u00ad", "")
+    text = re.sub(r"(\w)-\s*\n\s*(\w)", r"\1\2", text)
+    lines = (re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def extract_pages(path):
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return [normalize_text(page.extract_text() or "") for page in reader.pages]
+
+
+def begin_document(conn, path, sha256, page_count):
+    # Страницы незавершённой загрузки того же файла сохраняются — загрузка продолжится с места остановки
+    row = conn.execute(
+        "SELECT sha256, page_count FROM documents WHERE path = ?",
+        (path,)
+    ).fetchone()
+
+    if row != (sha256, page_count):
+        conn.execute("DELETE FROM pages WHERE path = ?", (path,))
+        conn.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(path, size, mtime_ns, sha256, page_count, complete) "
+            "VALUES (?, NULL, NULL, ?, ?, 0)",
+            (path, sha256, page_count)
+        )
+        conn.commit()
+
+
+def stored_pages(conn, path, non_empty=False):
+    sql = "SELECT page_no FROM pages WHERE path = ?"
+    if non_empty:
+        sql += " AND trim(text) != ''"
+    return {row[0] for row in conn.execute(sql, (path,))}
+
+
+def store_page(conn, path, page_no, text):
+    conn.execute(
+        "INSERT OR REPLACE INTO pages (path, page_no, text) VALUES (?, ?, ?)",
+        (path, page_no, text)
+    )
+
+
+def finish_document(conn, path):
+    st = os.stat(path)
+    conn.execute(
+        "UPDATE documents SET size = ?, mtime_ns = ?, complete = 1 WHERE path = ?",
+        (st.st_size, st.st_mtime_ns, path)
+    )
+    conn.commit()
+
+
+def drop_document(conn, path):
+    conn.execute("DELETE FROM pages WHERE path = ?", (path,))
+    conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+    conn.commit()
+
+
+def store_document(conn, path, texts):
+    begin_document(conn, path, file_hash(path), len(texts))
+    for page_no, text in enumerate(texts):
+        store_page(conn, path, page_no, text)
+    finish_document(conn, path)
+
+
+def sync_store(conn, folder=PDF_FOLDER):
+    paths = list_pdfs(folder)
+
+    for path in paths:
+        if is_fresh(conn, path):
+            continue
+        if PyPDF2 is None:
+            continue
+        print(f"Извлечение текста: {path}")
+        try:
+            store_document(conn, path, extract_pages(path))
+        except Exception as e:
+            # Битый файл выпадает из поиска, остальные документы работают
+            print(f"Не удалось прочитать {path}:", e)
+            drop_document(conn, path)
+
+    # Удалённые из папки файлы больше не участвуют в поиске
+    known = [row[0] for row in conn.execute("SELECT path FROM documents")]
+    for path in known:
+        if path.startswith(folder) and path not in paths:
+            conn.execute("DELETE FROM pages WHERE path = ?", (path,))
+            conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+    conn.commit()
+
+    return paths
+
+# ================== ЧТЕНИЕ ==================
+
+def folder_signature(folder=PDF_FOLDER):
+    signature = []
+    for path in list_pdfs(folder):
+        st = os.stat(path)
+        signature.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+def get_pages(folder=PDF_FOLDER):
+    # Список (файл, номер страницы, текст); перечитывается только
+    # когда в папке меняется состав файлов или их размер/mtime
+    global _pages, _signature
+
+    signature = folder_signature(folder)
+
+    with _lock:
+        if _pages is not None and signature == _signature:
+            return _pages
+
+        conn = connect()
+        try:
+            paths = sync_store(conn, folder)
+            rows = conn.execute(
+                "SELECT path, page_no, text FROM pages ORDER BY path, page_no"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        _pages = [
+            (os.path.basename(path), page_no, text)
+            for path, page_no, text in rows
+            if path in paths
+        ]
+        _signature = signature
+        return _pages
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# ================== НАСТРОЙКИ ==================
+
+# Частота опроса стеков: 100 раз в секунду почти не нагружает бот
+SAMPLE_INTERVAL = 0.01
+
+# Верхний предел длительности одного профилирования, секунды
+MAX_SECONDS = 300
+
+# Вершины стека простаивающих потоков: ожидание событий, очередей и задач пула
+IDLE_FRAMES = ("select (selectors.py", "wait (threading.py", "_worker (thread.py", "dequeue (handlers.py")
+
+_lock = threading.Lock()
+
+# ================== ПРОФИЛИРОВЩИК ==================
+
+# Выборочный профилировщик без зависимостей: поток раз в SAMPLE_INTERVAL снимает
+# стеки всех потоков процесса (цикл событий, пулы workers, писатель БД) через
+# sys._current_frames. Результат — collapsed stacks («поток;функция;...;функция N»),
+# который открывают speedscope.app и flamegraph.pl
+
+
+def frame_name(frame):
+    code = frame.f_code
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(";", ":")
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def running():
+    return _lock.locked()
+
+
+def sample(seconds, interval=SAMPLE_INTERVAL):
+    # Блокирующий вызов — запускается в отдельном потоке; одновременно только один профиль
+    if not _lock.acquire(blocking=False):
+        return None
+
+    try:
+        stacks = Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + min(seconds, MAX_SECONDS)
+        samples = 0
+
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                thread = names.get(ident, str(ident)).replace(";", ":")
+                stacks[thread + ";" + collapse(frame)] += 1
+            samples += 1
+            time.sleep(interval)
+
+        return samples, stacks
+    finally:
+        _lock.release()
+
+
+def collapsed_text(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_functions(stacks, limit=10):
+    # Собственное время без простоя: сколько выборок функция была на вершине стека
+    own = Counter()
+    for stack, count in stacks.items():
+        name = stack.rsplit(";", 1)[-1]
+        if not name.startswith(IDLE_FRAMES):
+            own[name] += count
+    total = sum(own.values()) or 1
+    return [(name, count / total) for name, count in own.most_common(limit)]
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import metrics
+from workers import Overloaded
+
+# ================== НАСТРОЙКИ ==================
+
+# Веса классов по роли из show_start: при нехватке мест практикующие
+# инженеры обслуживаются чаще, но студенты всё равно получают свою долю
+ROLE_WEIGHTS = {
+    "user_engineer": 4,
+    "user_oldschool": 2,
+    "user_student": 1,
+}
+
+DEFAULT_ROLE = "other"
+DEFAULT_WEIGHT = 1
+
+# ================== ПЛАНИРОВЩИК ==================
+
+class PriorityScheduler:
+
+    # Взвешенная справедливая очередь (stride scheduling): у каждого класса
+    # свой виртуальный «проход», который растёт на 1/вес за каждое обслуживание;
+    # следующее место получает непустой класс с наименьшим проходом
+
+    def __init__(self, name, concurrency, max_queue, weights=ROLE_WEIGHTS):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.weights = dict(weights)
+        self.active = 0
+        self.waiting = 0
+        self._queues = {}
+        self._passes = {}
+        self._global_pass = 0.0
+
+        self._depth = metrics.gauge(f"{name}_queue_depth", "Запросы в очереди")
+        self._active = metrics.gauge(f"{name}_active", "Выполняемые запросы")
+
+    def role_of(self, role):
+        return role if role in self.weights else DEFAULT_ROLE
+
+    @asynccontextmanager
+    async def slot(self, role=None):
+        role = self.role_of(role)
+        started = time.monotonic()
+
+        if self.active < self.concurrency and not self.waiting:
+            self._grant()
+        else:
+            if self.waiting >= self.max_queue:
+                raise Overloaded(self.name)
+            await self._wait(role)
+
+        metrics.histogram(
+            f"{self.name}_queue_wait_seconds", "Ожидание в очереди", {"role": role}
+        ).observe(time.monotonic() - started)
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _wait(self, role):
+        queue = self._queues.get(role)
+        if queue is None:
+            queue = self._queues[role] = deque()
+
+        # Класс, простаивавший долго, не получает накопленного преимущества
+        if not queue:
+            self._passes[role] = max(self._passes.get(role, 0.0), self._global_pass)
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        self.waiting += 1
+        self._depth.set(self.waiting)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                queue.remove(future)
+                self.waiting -= 1
+                self._depth.set(self.waiting)
+            else:
+                # Место уже выдано, но ожидающий отменён — возвращаем его
+                self._release()
+            raise
+
+    def _grant(self):
+        self.active += 1
+        self._active.set(self.active)
+
+    def _release(self):
+        self.active -= 1
+        self._active.set(self.active)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.concurrency and self.waiting:
+            role = min(
+                (role for role, queue in self._queues.items() if queue),
+                key=lambda role: self._passes[role]
+            )
+            self._global_pass = self._passes[role]
+            self._passes[role] += 1 / self.weights.get(role, DEFAULT_WEIGHT)
+
+            future = self._queues[role].popleft()
+            self.waiting -= 1
+            self._depth.set(self.waiting)
+
+            self._grant()
+            future.set_result(None)
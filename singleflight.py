@@ -0,0 +1,70 @@
+import asyncio
+
+import metrics
+
+# ================== ОБЪЕДИНЕНИЕ ОДИНАКОВЫХ ЗАПРОСОВ ==================
+
+# Одинаковые вопросы, пришедшие одновременно, выполняются один раз:
+# первый запускает работу, остальные ждут тот же результат и получают
+# те же промежуточные фрагменты ответа. Работа отменяется, только когда
+# от неё отказались все ожидающие.
+
+WAITERS = metrics.gauge("singleflight_waiters", "Запросы, ожидающие результат чужого выполнения")
+INFLIGHT = metrics.gauge("singleflight_inflight", "Выполняемые уникальные запросы")
+SHARED = metrics.counter("singleflight_shared_total", "Запросы, получившие общий результат")
+
+
+class _Flight:
+
+    def __init__(self):
+        self.task = None
+        self.listeners = []
+        self.callers = 0
+        self.progress = None
+
+    async def broadcast(self, text):
+        self.progress = text
+        for listener in list(self.listeners):
+            await listener(text)
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key, fn, on_progress=None):
+        # fn(progress) — корутина; progress(text) рассылает фрагмент всем ожидающим
+        flight = self._flights.get(key)
+        leader = flight is None
+
+        if leader:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(fn(flight.broadcast))
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            INFLIGHT.inc()
+        else:
+            SHARED.inc()
+            WAITERS.inc()
+            if on_progress is not None and flight.progress is not None:
+                await on_progress(flight.progress)
+
+        if on_progress is not None:
+            flight.listeners.append(on_progress)
+        flight.callers += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.callers -= 1
+            if on_progress is not None:
+                flight.listeners.remove(on_progress)
+            if not leader:
+                WAITERS.dec()
+            if flight.callers == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            INFLIGHT.dec()
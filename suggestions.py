@@ -0,0 +1,71 @@
+import os
+from datetime import datetime
+
+from openpyxl import load_workbook
+
+from excel_export import export_xlsx
+
+# ================== НАСТРОЙКИ ==================
+
+# Как часто выгружать новые предложения в xlsx, секунды
+EXPORT_INTERVAL = 600
+
+# ================== ТАБЛИЦА ПРЕДЛОЖЕНИЙ ==================
+
+# Каждое предложение — одна строка INSERT через писателя database, без чтения
+# и перезаписи книги Excel; xlsx теперь только выгрузка из этой таблицы
+
+def init_suggestions(conn, legacy_file=None):
+    c = conn.cursor()
+
+    exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'suggestions'"
+    ).fetchone()
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS suggestions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            username TEXT,
+            user_id INTEGER,
+            text TEXT
+        )
+    """)
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_suggestions_date ON suggestions (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_suggestions_user ON suggestions (user_id)")
+
+    # При первом запуске переносим предложения, уже записанные в xlsx
+    if not exists and legacy_file and os.path.exists(legacy_file):
+        wb = load_workbook(legacy_file, read_only=True)
+        rows = [
+            (tuple(row) + (None,) * 4)[:4] for row in wb.active.iter_rows(min_row=2, values_only=True)
+            if row and any(value is not None for value in row[:4])
+        ]
+        wb.close()
+
+        c.execute("BEGIN")
+        c.executemany(
+            "INSERT INTO suggestions (date, username, user_id, text) VALUES (?, ?, ?, ?)",
+            [tuple(str(v) if isinstance(v, datetime) else v for v in row) for row in rows]
+        )
+
+    conn.commit()
+
+
+def add_suggestion(conn, user_id, username, text):
+    # Выполняется потоком-писателем database в общей групповой транзакции
+    conn.execute(
+        "INSERT INTO suggestions (date, username, user_id, text) VALUES (?, ?, ?, ?)",
+        (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), username, user_id, text)
+    )
+
+
+def last_suggestion_id(conn):
+    return conn.execute("SELECT MAX(id) FROM suggestions").fetchone()[0]
+
+# ================== ВЫГРУЗКА ==================
+
+def export_suggestions(conn, path):
+    # Потоковая выгрузка порциями через excel_export; файл подменяется целиком
+    export_xlsx(conn, path, ["suggestions"])
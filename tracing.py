@@ -0,0 +1,246 @@
+import argparse
+import contextvars
+import glob
+import itertools
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# ================== НАСТРОЙКИ ==================
+
+# Каждое обновление Telegram — трасса с уникальным ID, этапы внутри — вложенные
+# интервалы (spans). Трассы пишутся строками JSON в TRACE_FILE с ротацией;
+# пустой TRACE_FILE отключает запись
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+# Записывать только трассы не короче этого, секунды
+TRACE_MIN_SECONDS = float(os.getenv("TRACE_MIN_SECONDS", "0"))
+
+_trace = contextvars.ContextVar("trace", default=None)
+_parent = contextvars.ContextVar("span", default=None)
+
+_logger = logging.getLogger("structai.traces")
+_logger.propagate = False
+_listener = None
+
+# ================== ТРАССЫ ==================
+
+class Trace:
+
+    def __init__(self, name, attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self._ids = itertools.count(1)
+
+
+class Span:
+
+    # Вне трассы (trace=None) интервал только измеряет время и никуда не пишется
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.id = next(trace._ids) if trace else None
+        self.parent = _parent.get()
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+            if self.trace is not None:
+                self.trace.spans.append(self)
+
+
+def begin(name, **attrs):
+    # Контекст копируется в задачи и (через workers) в потоки пулов,
+    # поэтому всё, что запущено из обработчика, попадает в его трассу
+    trace = Trace(name, attrs)
+    _trace.set(trace)
+    _parent.set(None)
+    return trace
+
+
+def start_span(name, **attrs):
+    # Интервал, который закрывается явно через end(), — например, до первого токена
+    return Span(_trace.get(), name, attrs)
+
+
+@contextmanager
+def span(name, histogram=None, **attrs):
+    # Вложенные интервалы получают этот как родителя; histogram — метрика того же этапа
+    current = start_span(name, **attrs)
+    token = _parent.set(current.id) if current.trace else None
+    try:
+        yield current
+    finally:
+        if token is not None:
+            _parent.reset(token)
+        current.end()
+        if histogram is not None:
+            histogram.observe(current.duration)
+
+
+def finish():
+    trace = _trace.get()
+    if trace is None:
+        return
+    _trace.set(None)
+
+    duration = time.perf_counter() - trace.started
+    if _listener is None or duration < TRACE_MIN_SECONDS:
+        return
+
+    _logger.info(json.dumps({
+        "trace_id": trace.id,
+        "name": trace.name,
+        "start": datetime.fromtimestamp(trace.started_at).isoformat(timespec="milliseconds"),
+        "duration": round(duration, 6),
+        **trace.attrs,
+        "spans": [
+            {
+                "id": s.id,
+                "parent": s.parent,
+                "name": s.name,
+                "start": round(s.started - trace.started, 6),
+                "duration": round(s.duration, 6),
+                **s.attrs
+            }
+            for s in sorted(trace.spans, key=lambda s: s.started)
+        ]
+    }, ensure_ascii=False, default=str))
+
+# ================== ЗАПИСЬ ==================
+
+def start(path=TRACE_FILE):
+    # Файл пишет отдельный поток слушателя очереди — цикл событий не ждёт диска
+    global _listener
+    if not path or _listener is not None:
+        return
+
+    handler = RotatingFileHandler(path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records = queue.SimpleQueue()
+    _logger.addHandler(QueueHandler(records))
+    _logger.setLevel(logging.INFO)
+    _listener = QueueListener(records, handler)
+    _listener.start()
+
+
+def stop():
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+# ================== ОТЧЁТ ==================
+
+BAR_WIDTH = 40
+
+
+def read_traces(path):
+    # Текущий файл и ротированные копии traces.jsonl.1, .2, ...
+    traces = []
+    for name in [path] + sorted(glob.glob(path + ".*")):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    continue
+    return traces
+
+
+def bar(start, duration, total):
+    # Полоса на шкале времени трассы: отступ — начало интервала, длина — его продолжительность
+    scale = BAR_WIDTH / total if total else 0
+    offset = min(BAR_WIDTH - 1, int(start * scale))
+    length = max(1, round(duration * scale))
+    return (" " * offset + "█" * length)[:BAR_WIDTH].ljust(BAR_WIDTH)
+
+
+def print_trace(rank, trace):
+    extra = " ".join(f"{k}={trace[k]}" for k in trace if k not in ("trace_id", "name", "start", "duration", "spans"))
+    print(f"#{rank} {trace['duration']:.3f} с  {trace['name']}  {trace['start']}  trace={trace['trace_id']} {extra}")
+
+    children = defaultdict(list)
+    for s in trace["spans"]:
+        children[s["parent"]].append(s)
+
+    def walk(parent, depth):
+        for s in children.get(parent, []):
+            label = ("  " * depth + s["name"])[:34]
+            print(f"  {label:<34} {bar(s['start'], s['duration'], trace['duration'])} {s['duration']:8.3f}")
+            walk(s["id"], depth + 1)
+
+    walk(None, 0)
+    print()
+
+
+def print_summary(traces):
+    # Куда в сумме ушло время медленных запросов, по именам этапов
+    totals = defaultdict(float)
+    counts = defaultdict(int)
+    for trace in traces:
+        for s in trace["spans"]:
+            totals[s["name"]] += s["duration"]
+            counts[s["name"]] += 1
+
+    overall = sum(trace["duration"] for trace in traces)
+    print(f"{'этап':<30}{'раз':>6}{'всего, с':>11}{'доля':>8}")
+    for name in sorted(totals, key=totals.get, reverse=True):
+        print(f"{name:<30}{counts[name]:>6}{totals[name]:>11.3f}{totals[name] / overall:>8.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор самых медленных запросов по трассам")
+    parser.add_argument("--file", default=TRACE_FILE or "traces.jsonl")
+    parser.add_argument("--top", type=int, default=5, help="сколько самых медленных трасс показать")
+    parser.add_argument("--name", default="", help="только трассы, имя которых начинается с этой строки")
+    parser.add_argument("--trace", help="показать одну трассу по ID")
+    args = parser.parse_args()
+
+    traces = [t for t in read_traces(args.file) if t["name"].startswith(args.name)]
+    if args.trace:
+        traces = [t for t in traces if t["trace_id"] == args.trace]
+    if not traces:
+        print("Трасс нет.")
+        return
+
+    traces.sort(key=lambda t: t["duration"], reverse=True)
+    slowest = traces[:args.top]
+
+    durations = sorted(t["duration"] for t in traces)
+    p99 = durations[min(len(durations) - 1, int(0.99 * len(durations)))]
+    print(f"Трасс: {len(traces)}, p50={durations[len(durations) // 2]:.3f} с, p99={p99:.3f} с\n")
+
+    for rank, trace in enumerate(slowest, 1):
+        print_trace(rank, trace)
+
+    print_summary(slowest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter, namedtuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from db import DB_FILE, database
+from pdf_index import tokenize
+
+# ================== НАСТРОЙКИ ==================
+
+INDEX_FILE = os.path.splitext(DB_FILE)[0] + ".faiss"
+
+DIM = 1024
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+
+Passage = namedtuple("Passage", "score document page_no text")
+
+# ================== ЭМБЕДДИНГИ ==================
+
+# Офлайн-эмбеддер: хешированные TF-признаки слов и биграмм.
+# Документы хранятся как нормированный сублинейный TF,
+# IDF применяется к вектору вопроса по частотам корзин корпуса.
+
+def features(text):
+    tokens = tokenize(text)
+    return tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+
+
+def bucket(feature):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % DIM, (1.0 if h & 0x80000000 else -1.0)
+
+
+def embed(text):
+    vec = np.zeros(DIM, dtype="float32")
+    for feature, tf in Counter(features(text)).items():
+        i, sign = bucket(feature)
+        vec[i] += sign * (1 + math.log(tf))
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+# ================== НАРЕЗКА ==================
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    text = re.sub(r"\s+", " ", text).strip()
+    chunks = []
+    start = 0
+
+    while start < len(text):
+        end = min(start + size, len(text))
+        # Режем по концу предложения или хотя бы по пробелу
+        if end < len(text):
+            cut = max(text.rfind(". ", start + size // 2, end), text.rfind(" ", start + size // 2, end))
+            if cut > start:
+                end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+
+    return chunks
+
+# ================== ИНДЕКС ==================
+
+_lock = threading.Lock()
+_index = None
+_df = None
+_docs = 0
+
+
+def init_passages(conn):
+    c = conn.cursor()
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS passages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document TEXT,
+            page_no INTEGER,
+            text TEXT
+        )
+    """)
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_passages_document ON passages (document, page_no)")
+
+    conn.commit()
+
+
+def _rebuild(conn):
+    # Индекс FAISS потерян или разошёлся с таблицей — пересчитываем векторы
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(DIM))
+    df = np.zeros(DIM, dtype="float32")
+    rows = conn.execute("SELECT id, text FROM passages ORDER BY id").fetchall()
+
+    for start in range(0, len(rows), 1000):
+        batch = rows[start:start + 1000]
+        vectors = np.stack([embed(text) for _, text in batch])
+        index.add_with_ids(vectors, np.array([row[0] for row in batch], dtype="int64"))
+        df += (vectors != 0).sum(axis=0)
+
+    return index, df, len(rows)
+
+
+def _load():
+    global _index, _df, _docs
+
+    if _index is not None:
+        return
+
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        init_passages(conn)
+        count = conn.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+
+        if os.path.exists(INDEX_FILE) and os.path.exists(INDEX_FILE + ".df.npy"):
+            index = faiss.read_index(INDEX_FILE)
+            df = np.load(INDEX_FILE + ".df.npy")
+            if index.ntotal == count:
+                _index, _df, _docs = index, df, count
+                return
+
+        _index, _df, _docs = _rebuild(conn)
+    finally:
+        conn.close()
+
+    _save()
+
+
+def _save():
+    faiss.write_index(_index, INDEX_FILE)
+    np.save(INDEX_FILE + ".df.npy", _df)
+
+
+def load():
+    # Загрузить или пересобрать индекс заранее, а не на первом запросе
+    if faiss is None:
+        return
+    with _lock:
+        _load()
+
+
+def save():
+    with _lock:
+        if _index is not None:
+            _save()
+
+
+def add_document(name, text, page_no=None, save=True):
+    chunks = chunk_text(text)
+    return add_chunks(name, page_no, chunks, save=save)
+
+
+def add_chunks(name, page_no, chunks, vectors=None, save=True):
+    # vectors можно посчитать заранее (embed) — например, в процессах загрузчика
+
+    if faiss is None or not chunks:
+        return 0
+
+    if vectors is None:
+        vectors = np.stack([embed(chunk) for chunk in chunks])
+
+    global _df, _docs
+
+    with _lock:
+        _load()
+
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            ids = []
+            for chunk in chunks:
+                cur = conn.execute(
+                    "INSERT INTO passages (document, page_no, text) VALUES (?, ?, ?)",
+                    (name, page_no, chunk)
+                )
+                ids.append(cur.lastrowid)
+
+            _index.add_with_ids(vectors, np.array(ids, dtype="int64"))
+            _df += (vectors != 0).sum(axis=0)
+            _docs += len(chunks)
+            conn.commit()
+        finally:
+            conn.close()
+
+        if save:
+            _save()
+
+    return len(chunks)
+
+
+def indexed_pages(name):
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        init_passages(conn)
+        return {
+            row[0]
+            for row in conn.execute(
+                "SELECT DISTINCT page_no FROM passages WHERE document = ?",
+                (name,)
+            )
+        }
+    finally:
+        conn.close()
+
+
+def remove_document(name, page_no=None, save=True):
+
+    if faiss is None:
+        return 0
+
+    global _df, _docs
+
+    with _lock:
+        _load()
+
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            if page_no is None:
+                rows = conn.execute(
+                    "SELECT id, text FROM passages WHERE document = ?",
+                    (name,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, text FROM passages WHERE document = ? AND page_no = ?",
+                    (name, page_no)
+                ).fetchall()
+
+            if not rows:
+                return 0
+
+            ids = [row[0] for row in rows]
+            conn.execute(
+                f"DELETE FROM passages WHERE id IN ({','.join('?' * len(ids))})",
+                ids
+            )
+            _index.remove_ids(np.array(ids, dtype="int64"))
+            vectors = np.stack([embed(text) for _, text in rows])
+            _df -= (vectors != 0).sum(axis=0)
+            _docs -= len(ids)
+            conn.commit()
+        finally:
+            conn.close()
+
+        if save:
+            _save()
+
+    return len(rows)
+
+
+def search(question, k=5):
+
+    if faiss is None:
+        return []
+
+    with _lock:
+        _load()
+
+        if _docs == 0:
+            return []
+
+        query = embed(question)
+        idf = np.log(1 + _docs / (1 + _df))
+        query = query * idf
+        norm = np.linalg.norm(query)
+        if not norm:
+            return []
+        query = (query / norm).astype("float32").reshape(1, -1)
+
+        scores, ids = _index.search(query, k)
+
+    found = [(float(score), int(i)) for score, i in zip(scores[0], ids[0]) if i >= 0]
+    if not found:
+        return []
+
+    with database.reader() as conn:
+        rows = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                f"SELECT id, document, page_no, text FROM passages "
+                f"WHERE id IN ({','.join('?' * len(found))})",
+                [i for _, i in found]
+            )
+        }
+
+    return [Passage(score, *rows[i]) for score, i in found if i in rows]
@@ -0,0 +1,62 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# ================== ПУЛЫ ДЛЯ БЛОКИРУЮЩЕЙ РАБОТЫ ==================
+
+# Поиск по индексам и SQLite выполняются в отдельных потоках,
+# чтобы не останавливать цикл событий бота. Очередь каждого пула
+# ограничена: при переполнении сразу возвращается Overloaded,
+# а не копится бесконечный хвост задач.
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BoundedExecutor:
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.limit = workers + max_queue
+        self.pending = 0
+        self._pending = metrics.gauge(f"{name}_pool_pending", "Задачи в пуле: выполняются и ждут потока")
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+            self._pending.set(self.pending)
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.limit:
+                raise Overloaded(self.name)
+            self.pending += 1
+            self._pending.set(self.pending)
+
+        try:
+            # Как asyncio.to_thread: задача видит contextvars вызывающего (трассу запроса)
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release(None)
+            raise
+
+        # Счётчик уменьшается, когда задача действительно завершилась в потоке,
+        # даже если ожидающая корутина уже отменена
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+retrieval_pool = BoundedExecutor("retrieval", workers=4, max_queue=32)
+io_pool = BoundedExecutor("io", workers=4, max_queue=64)